@@ -1,3 +1,6 @@
+import hashlib
+from math import exp, inf, log, log1p
+
 def remove_duplicates(my_list):
     # Helper function to remove duplicates from a list
     return list(set(my_list))
@@ -32,22 +35,21 @@ class Semiring():
     # Now we can write functions that will be well-defined for 
     # any semiring type.
     def big_gconj(self, values):
-        # Performs gconj across all values in a list
-        if not values:
-            return self.gtrue
-
-        first = values[0]
-        rest = values[1:]
-        return self.gconj(first, self.big_gconj(rest))
+        # Performs gconj across all values in a list. The values are 
+        # combined from the right, gconj(values[0], gconj(values[1], ...)), 
+        # in a loop rather than by recursion, so this takes linear time and 
+        # works on lists of any length.
+        result = self.gtrue
+        for value in reversed(values):
+            result = self.gconj(value, result)
+        return result
 
     def big_gdisj(self, values):
-        # Performs gdisj across all values in alist
-        if not values:
-            return self.gfalse
-
-        first = values[0]
-        rest = values[1:]
-        return self.gdisj(first, self.big_gdisj(rest))
+        # Performs gdisj across all values in a list, in the same way
+        result = self.gfalse
+        for value in reversed(values):
+            result = self.gdisj(value, result)
+        return result
 
     def distrib_lhs(self, x, y, z):
         # Calculates the lefthand side of the distributive equation
@@ -60,64 +62,182 @@ class Semiring():
         return self.gdisj(self.gconj(x, y), self.gconj(x, z))
 
     def dotprod(self, x, y):
-        # Calculates the 'semiring dotproduct'
-        if not x or not y:
-            return self.gfalse
-
-        first_x = x[0]
-        rest_x = x[1:]
-        first_y = y[0]
-        rest_y = y[1:]
-        return self.gdisj(
-            self.gconj(first_x, first_y), 
-            self.dotprod(rest_x, rest_y)
-        )
+        # Calculates the 'semiring dotproduct'. Like zip, this stops at the
+        # end of the shorter list.
+        result = self.gfalse
+        for first_x, first_y in reversed(list(zip(x, y))):
+            result = self.gdisj(self.gconj(first_x, first_y), result)
+        return result
 
     def expn(self, x, num):
-        # Applies gconj to x num times.
-        if num <= 0:
-            return self.gtrue
-
-        return self.gconj(x, self.expn(x, num - 1)) 
+        # Applies gconj to x num times. Squaring x repeatedly and 
+        # combining the powers that make up num takes O(log num) gconjs
+        # rather than num.
+        result = self.gtrue
+        while num > 0:
+            if num % 2 == 1:
+                result = self.gconj(result, x)
+            num //= 2
+            if num > 0:
+                x = self.gconj(x, x)
+        return result
 
 # Here's a generic automaton type that takes a semiring
 # and uses it to perform operations on its values
 class GenericAutomaton():
-    def __init__(self, starts, ends, deltas, semiring):
+    def __init__(self, starts, ends, deltas, semiring, states=None):
         self.starts = starts
         self.ends = ends
         self.deltas = deltas
         self.sr = semiring
+        # Optionally, the order to keep the states in (see compile)
+        self.states = states
+        self.compile()
+
+    def compile(self):
+        # Builds the lookup tables used by all_states, init, fin, tr and the
+        # recursions, so that none of them has to scan starts, ends or
+        # deltas again. Call this again if you modify any of those lists
+        # after the automaton has been created.
+        states = {}
+        for q in self.states or []:
+            states.setdefault(q, len(states))
+        for (q, _) in list(self.starts) + list(self.ends):
+            states.setdefault(q, len(states))
+        for (q1, _, _, q2) in self.deltas:
+            states.setdefault(q1, len(states))
+            states.setdefault(q2, len(states))
+        # States are kept in the order given by self.states, and otherwise
+        # in order of first appearance, so the order in which values are
+        # combined doesn't depend on set/hash ordering
+        self._states = list(states)
+
+        self._init = self._collect((q, v) for (q, v) in self.starts)
+        self._fin = self._collect((q, v) for (q, v) in self.ends)
+        self._tr = self._collect(
+            ((q1, x, q2), p) for (q1, x, p, q2) in self.deltas
+        )
+
+        # (state, symbol) -> [(weight, next_state)] for the backward
+        # direction and (state, symbol) -> [(weight, previous_state)] for the
+        # forward direction. Other states are listed in state order and
+        # transitions whose weight is gfalse are left out.
+        self._arcs = {}
+        self._arcs_in = {}
+        for (q1, x, q2), p in sorted(
+                self._tr.items(), key=lambda item: states[item[0][2]]):
+            if p != self.sr.gfalse:
+                self._arcs.setdefault((q1, x), []).append((p, q2))
+        for (q1, x, q2), p in sorted(
+                self._tr.items(), key=lambda item: states[item[0][0]]):
+            if p != self.sr.gfalse:
+                self._arcs_in.setdefault((q2, x), []).append((p, q1))
+
+    def map_weights(self, function, semiring):
+        # Returns a copy of this automaton over another semiring, with 
+        # function applied to every initial, final and transition weight
+        return GenericAutomaton(
+            starts = [(q, function(v)) for (q, v) in self.starts],
+            ends = [(q, function(v)) for (q, v) in self.ends],
+            deltas = [(q1, x, function(p), q2) for (q1, x, p, q2) in self.deltas],
+            semiring = semiring,
+            states = self._states
+        )
+
+    def _collect(self, pairs):
+        # Groups values by key and combines each group with big_gdisj
+        grouped = {}
+        for key, v in pairs:
+            grouped.setdefault(key, []).append(v)
+        return {key: self.sr.big_gdisj(vs) for key, vs in grouped.items()}
+
+    def fingerprint(self):
+        # Returns a hash of the automaton's definition. Any change to its 
+        # starts, ends, deltas, state order or semiring type gives a 
+        # different value, so this can be used to key anything derived from
+        # the automaton.
+        definition = (type(self.sr).__name__, self.starts, self.ends, self.deltas)
+        if self.states:
+            # The order of the states decides the order of the parses
+            definition += (self.states,)
+        definition = repr(definition)
+        return hashlib.sha1(definition.encode('utf-8')).hexdigest()
 
     def all_states(self):
         # Returns all states in the FSA
-        return remove_duplicates(
-            [q for (q, _) in self.starts] + 
-            [q for (q, _) in self.ends] + 
-            [q for (q1, _, _, q2) in self.deltas for q in (q1, q2)]
-        )
+        return self._states
 
     def init(self, q):
-        return self.sr.big_gdisj([v for (q1, v) in self.starts if q == q1])
+        return self._init.get(q, self.sr.gfalse)
 
     def fin(self, q):
-        return self.sr.big_gdisj([v for (q1, v) in self.ends if q == q1])
+        return self._fin.get(q, self.sr.gfalse)
 
     def tr(self, q1, x, q2):
-        return self.sr.big_gdisj(
-            [p for (q3, y, p, q4) in self.deltas if (q3, y, q4) == (q1, x, q2)]
-        )
+        return self._tr.get((q1, x, q2), self.sr.gfalse)
+
+    def arcs(self, q, x):
+        # Returns the (weight, next_state) pairs leaving q on symbol x
+        return self._arcs.get((q, x), [])
+
+    def arcs_in(self, q, x):
+        # Returns the (weight, previous_state) pairs entering q on symbol x
+        return self._arcs_in.get((q, x), [])
+
+    def backward_chart(self, sequence):
+        # Fills a chart whose row i maps each state q to
+        # backward(sequence[i:], q), working from the end of the sequence.
+        # Every cell is computed once from the row after it, so this takes
+        # O(n * |transitions|) time and never recurses. States whose value
+        # is gfalse are left out of their row.
+        n = len(sequence)
+        chart = [None] * (n + 1)
+        chart[n] = {q: v for (q, v) in self._fin.items() 
+                    if v != self.sr.gfalse}
+
+        for i in range(n - 1, -1, -1):
+            x = sequence[i]
+            following = chart[i + 1]
+            row = {}
+            for q in self._states:
+                subvals = [self.sr.gconj(p, following[q1])
+                           for (p, q1) in self.arcs(q, x) if q1 in following]
+                if subvals:
+                    val = self.sr.big_gdisj(subvals)
+                    if val != self.sr.gfalse:
+                        row[q] = val
+            chart[i] = row
+
+        return chart
+
+    def forward_chart(self, sequence):
+        # The mirror image of backward_chart: row i maps each state q to
+        # forward(sequence[:i], q), working from the start of the sequence
+        n = len(sequence)
+        chart = [None] * (n + 1)
+        chart[0] = {q: v for (q, v) in self._init.items() 
+                    if v != self.sr.gfalse}
+
+        for i in range(n):
+            x = sequence[i]
+            preceding = chart[i]
+            row = {}
+            for q in self._states:
+                subvals = [self.sr.gconj(preceding[q1], p)
+                           for (p, q1) in self.arcs_in(q, x) if q1 in preceding]
+                if subvals:
+                    val = self.sr.big_gdisj(subvals)
+                    if val != self.sr.gfalse:
+                        row[q] = val
+            chart[i + 1] = row
+
+        return chart
 
     def backward(self, sequence, q):
-        if not sequence:
-            return self.fin(q)
-            
-        first = sequence[0]
-        rest = sequence[1:]
-        return self.sr.big_gdisj(
-            [self.sr.gconj(self.tr(q, first, q1), self.backward(rest, q1)) 
-             for q1 in self.all_states() if self.tr(q, first, q1) != self.sr.gfalse]
-        )
+        return self.backward_chart(sequence)[0].get(q, self.sr.gfalse)
+
+    def forward(self, sequence, q):
+        return self.forward_chart(sequence)[-1].get(q, self.sr.gfalse)
 
     def backward2(self, sequence, q):
         # A version of backward using for loops instead of list comprehensions
@@ -139,9 +259,19 @@ class GenericAutomaton():
         return self.sr.big_gdisj(subvals)
 
     def val_b(self, sequence):
+        chart = self.backward_chart(sequence)[0]
         return self.sr.big_gdisj(
-            [self.sr.gconj(self.init(q), self.backward(sequence, q)) 
-             for q in self.all_states() if self.init(q) != self.sr.gfalse]
+            [self.sr.gconj(self.init(q), chart[q]) 
+             for q in self.all_states() 
+             if self.init(q) != self.sr.gfalse and q in chart]
+        )
+
+    def val_f(self, sequence):
+        chart = self.forward_chart(sequence)[-1]
+        return self.sr.big_gdisj(
+            [self.sr.gconj(chart[q], self.fin(q))
+             for q in self.all_states() 
+             if self.fin(q) != self.sr.gfalse and q in chart]
         )
 
     def val_b2(self, sequence):
@@ -188,6 +318,55 @@ class DoubleSemiring(Semiring):
     def gdisj(self, x, y):
         return x + y
 
+# Multiplying many probabilities together soon underflows to 0.0: gfsa1's
+# value for a sequence of a few hundred symbols is already too small for a
+# float. The Log semiring works with log probabilities instead, so `gconj x y'
+# is `x + y' and `gdisj x y' is `log(exp(x) + exp(y))', computed in a way
+# that doesn't underflow either.
+
+class LogSemiring(Semiring):
+    gtrue = 0.0
+    gfalse = -inf
+
+    def gconj(self, x, y):
+        return x + y
+
+    def gdisj(self, x, y):
+        if x == -inf:
+            return y
+        if y == -inf:
+            return x
+        return max(x, y) + log1p(exp(-abs(x - y)))
+
+    def big_gdisj(self, values):
+        # Sums all the values at once, relative to the largest one
+        top = max(values, default=-inf)
+        if top == -inf:
+            return self.gfalse
+        return top + log(sum(exp(v - top) for v in values))
+
+# In the Tropical semiring, values are costs (e.g. negative log 
+# probabilities): `gconj x y' is `x + y' and `gdisj x y' is `min x y', so
+# val_b gives the cost of the best path rather than the sum over all paths.
+
+class TropicalSemiring(Semiring):
+    gtrue = 0.0
+    gfalse = inf
+
+    def gconj(self, x, y):
+        return x + y
+
+    def gdisj(self, x, y):
+        return min(x, y)
+
+def log_weight(p):
+    # Probability to log probability, for map_weights
+    return log(p) if p > 0 else -inf
+
+def cost_weight(p):
+    # Probability to cost (negative log probability), for map_weights
+    return -log(p) if p > 0 else inf
+
 # Corresponds to the PFSA used in examples in class
 gfsa1 = GenericAutomaton(
     starts = [("Edge", 1.0)],
@@ -209,6 +388,11 @@ gfsa1 = GenericAutomaton(
     semiring = DoubleSemiring()
 )
 
+# gfsa1 with log probabilities, whose values are the logs of gfsa1's, and
+# with costs, whose values are the costs of the most likely paths
+gfsa1_log = gfsa1.map_weights(log_weight, LogSemiring())
+gfsa1_cost = gfsa1.map_weights(cost_weight, TropicalSemiring())
+
 # Corresponds to the FSA over the alphabet {C,V} that requires either two Cs or
 # two Vs (or both), now expressed as a generic automaton that has booleans as
 # its values
@@ -232,4 +416,7 @@ gfsa2 = GenericAutomaton(
 # print(gfsa1.val_b2('eta'))
 # print(gfsa1.val_b('eta'))
 # print(gfsa1.val_b2('ena'))
-# print(gfsa1.val_b('ena'))
\ No newline at end of file
+# print(gfsa1.val_b('ena'))
+
+# print(gfsa1_log.val_b('eta'))
+# print(gfsa1_cost.val_b('eta'))
\ No newline at end of file
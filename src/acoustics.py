@@ -0,0 +1,449 @@
+import argparse
+import functools
+import json
+import multiprocessing
+import numpy as np
+import os
+import process_textgrid
+import prosody
+import struct
+import syllable_features
+import textgrid_io
+import time
+
+# f0 and intensity measurements for syllable intervals, computed from a WAV
+# file in Python instead of by running data/audio/_ProsodyPro.praat.
+#
+# The signal is memory-mapped, cut into overlapping analysis frames with
+# one fancy-indexing operation per batch of frames, and analysed a batch at
+# a time: f0 by the autocorrelation method (Boersma 1993), and intensity as
+# windowed mean power in dB. From the frame tracks, interval_stats
+# reproduces what ProsodyPro's Means procedure computes for each labelled
+# interval: an f0 contour sampled at 100 Hz and smoothed with a triangular
+# window, its velocity in semitones per second, and the maxf0 ... minf0_loc_ratio
+# columns of pitchpro_*.tsv. ProsodyPro takes its raw f0 from (possibly
+# hand-corrected) glottal pulses rather than analysis frames, so the values
+# don't agree exactly; compare() measures by how much.
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+SAMPLE_TYPES = {
+	(WAVE_FORMAT_PCM, 8): np.uint8,
+	(WAVE_FORMAT_PCM, 16): np.dtype('<i2'),
+	(WAVE_FORMAT_PCM, 32): np.dtype('<i4'),
+	(WAVE_FORMAT_IEEE_FLOAT, 32): np.dtype('<f4'),
+	(WAVE_FORMAT_IEEE_FLOAT, 64): np.dtype('<f8')
+}
+
+# ProsodyPro's settings (the defaults in _ProsodyPro.praat)
+MIN_F0 = 75
+MAX_F0 = 600
+F0_SAMPLE_RATE = 100
+SMOOTHING_WINDOW = 0.07
+FINAL_OFFSET = -0.03
+
+# The smallest (normalized) autocorrelation of the analysis window that
+# the signal's autocorrelation is divided by
+MIN_WINDOW_AC = 0.4
+
+# Frames are analysed this many at a time, which bounds memory use
+BATCH_SIZE = 1024
+
+def read_wav(path):
+	"""
+	Memory-maps the samples of a WAV file. Returns (samples, sample_rate),
+	where samples is a (frames, channels) array of the file's sample type.
+	"""
+	with open(path, 'rb') as f:
+		riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+		if riff != b'RIFF' or wave != b'WAVE':
+			raise ValueError('{} is not a WAV file'.format(path))
+		fmt = None
+		while True:
+			header = f.read(8)
+			if len(header) < 8:
+				raise ValueError('No data in {}'.format(path))
+			chunk_id, chunk_size = struct.unpack('<4sI', header)
+			if chunk_id == b'data':
+				offset = f.tell()
+				break
+			chunk = f.read(chunk_size + chunk_size % 2)
+			if chunk_id == b'fmt ':
+				fmt = struct.unpack('<HHIIHH', chunk[:16])
+				if fmt[0] == WAVE_FORMAT_EXTENSIBLE:
+					fmt = (struct.unpack('<H', chunk[24:26])[0],) + fmt[1:]
+	if fmt is None:
+		raise ValueError('No format chunk in {}'.format(path))
+
+	format_tag, channels, sample_rate, _, _, bits = fmt
+	if (format_tag, bits) not in SAMPLE_TYPES:
+		raise ValueError('Unsupported WAV sample format in {}: {} bits, format {}'.format(
+			path, bits, format_tag
+		))
+	dtype = np.dtype(SAMPLE_TYPES[(format_tag, bits)])
+	# Some programs leave the data size at 0 or too big when they stream
+	# WAV files, so don't trust it past the end of the file
+	available = os.path.getsize(path) - offset
+	n = min(chunk_size or available, available) // (dtype.itemsize * channels)
+	samples = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(n, channels))
+	return samples, sample_rate
+
+def to_float(samples):
+	# Scales samples to [-1, 1] (which Praat treats as Pascal)
+	if samples.dtype == np.uint8:
+		return (samples.astype(np.float64) - 128) / 128
+	if np.issubdtype(samples.dtype, np.integer):
+		return samples.astype(np.float64) / -np.iinfo(samples.dtype).min
+	return samples.astype(np.float64)
+
+def frame_matrix(samples, sample_rate, times, window_length):
+	"""
+	Returns a (len(times), n) matrix of the window of n samples around each
+	time, averaged over channels and zero outside the signal. Only these
+	parts of a memory-mapped signal are read.
+	"""
+	n = int(round(window_length * sample_rate))
+	starts = np.rint(np.asarray(times) * sample_rate).astype(int) - n // 2
+	index = starts[:, None] + np.arange(n)
+	inside = (index >= 0) & (index < len(samples))
+	frames = to_float(samples[np.clip(index, 0, len(samples) - 1)]).mean(axis=-1)
+	frames[~inside] = 0
+	return frames
+
+def peak_amplitude(samples, batch=1 << 20):
+	peak = 0
+	for i in range(0, len(samples), batch):
+		peak = max(peak, np.abs(to_float(samples[i:i + batch])).max())
+	return peak
+
+def analyse_frames(samples, sample_rate, times, global_peak, min_f0=MIN_F0,
+				   max_f0=MAX_F0, voicing_threshold=0.45, silence_threshold=0.03,
+				   octave_cost=0.01):
+	"""
+	Computes f0 (NaN where unvoiced) and intensity (dB) for frames centred
+	on times, all at once
+	"""
+	# Pitch: Hann-windowed autocorrelation over three periods of the lowest
+	# f0, divided by the window's own autocorrelation
+	frames = frame_matrix(samples, sample_rate, times, 3 / min_f0)
+	n = frames.shape[1]
+	nfft = 1 << int(np.ceil(np.log2(2 * n)))
+	window = np.hanning(n)
+	window_ac = np.fft.irfft(np.abs(np.fft.rfft(window, nfft)) ** 2)[:n]
+	window_ac /= window_ac[0]
+
+	frames = frames - frames.mean(axis=1, keepdims=True)
+	local_peak = np.abs(frames).max(axis=1)
+	ac = np.fft.irfft(np.abs(np.fft.rfft(frames * window, nfft)) ** 2)[:, :n]
+	with np.errstate(divide='ignore', invalid='ignore'):
+		ac = ac / ac[:, :1] / window_ac
+
+	# Dividing by window_ac blows up errors where it gets small, so only
+	# search lags where it is still at least MIN_WINDOW_AC
+	min_lag = int(np.ceil(sample_rate / max_f0))
+	max_lag = min(int(np.ceil(sample_rate / min_f0)), int(np.argmax(window_ac < MIN_WINDOW_AC)) - 2)
+
+	# The candidates are the local maxima of the autocorrelation, their
+	# height and lag refined by parabolic interpolation. As in Praat,
+	# heights over 1 (an artefact of the division) are reflected, and each
+	# candidate pays octave_cost per octave below max_f0, so that a peak at
+	# twice the period, which a periodic signal always has as well, doesn't
+	# win by noise.
+	lags = np.arange(min_lag, max_lag + 1)
+	left, mid, right = ac[:, lags - 1], ac[:, lags], ac[:, lags + 1]
+	with np.errstate(divide='ignore', invalid='ignore'):
+		shift = 0.5 * (left - right) / (left - 2 * mid + right)
+		shift = np.where(np.abs(shift) < 1, shift, 0)
+		height = mid - 0.25 * (left - right) * shift
+		height = np.where(height > 1, 1 / height, height)
+	lag = lags + shift
+	is_peak = (mid > left) & (mid >= right) & np.isfinite(height)
+	strength = np.where(
+		is_peak, height - octave_cost * np.log2(min_f0 * lag / sample_rate), -np.inf
+	)
+	best = strength.argmax(axis=1)
+	rows = np.arange(len(best))
+	f0 = sample_rate / lag[rows, best]
+	voiced = (is_peak[rows, best] & (height[rows, best] > voicing_threshold)
+			  & (local_peak > silence_threshold * global_peak))
+	f0[~voiced] = np.nan
+
+	# Intensity: mean power under a Kaiser window of 3.2 periods of 100 Hz,
+	# the window Praat's To Intensity... 100 uses
+	frames = frame_matrix(samples, sample_rate, times, 3.2 / 100)
+	frames = frames - frames.mean(axis=1, keepdims=True)
+	window = np.kaiser(frames.shape[1], 20)
+	power = (frames ** 2 * window).sum(axis=1) / window.sum()
+	with np.errstate(divide='ignore'):
+		intensity = 10 * np.log10(power / 4e-10)
+	intensity[power <= 0] = np.nan
+	return f0, intensity
+
+def analyse_batch(wav_path, global_peak, times):
+	samples, sample_rate = read_wav(wav_path)
+	return analyse_frames(samples, sample_rate, times, global_peak)
+
+def tracks(wav_path, time_step=1 / F0_SAMPLE_RATE, jobs=1):
+	"""
+	Computes the f0 and intensity tracks of a WAV file. Returns arrays of
+	frame times, f0 and intensity. With jobs > 1 batches of frames are
+	analysed in parallel, each process mapping the file itself.
+	"""
+	samples, sample_rate = read_wav(wav_path)
+	global_peak = peak_amplitude(samples)
+	times = np.arange(0, len(samples) / sample_rate, time_step)
+	batches = [times[i:i + BATCH_SIZE] for i in range(0, len(times), BATCH_SIZE)]
+
+	work = functools.partial(analyse_batch, wav_path, global_peak)
+	if jobs > 1:
+		with multiprocessing.Pool(jobs) as pool:
+			results = pool.map(work, batches)
+	else:
+		results = [work(batch) for batch in batches]
+	f0 = np.concatenate([x[0] for x in results])
+	intensity = np.concatenate([x[1] for x in results])
+	return times, f0, intensity
+
+def trim(times, values, max_bump=0.01, max_edge=0.0, max_gap=0.033, repeats=3):
+	"""
+	ProsodyPro's Trimf0: flattens points that stick out from both of their
+	neighbours, replacing them by interpolation between the neighbours,
+	or capping them at the neighbour when there's a gap on the other side.
+	Each pass goes left to right using the values already trimmed.
+	"""
+	values = np.array(values, dtype=float)
+	n = len(values)
+	if n < 3:
+		return values
+	first, last = values[0], values[-1]
+	gaps = np.diff(times)
+	for _ in range(repeats):
+		for i in range(1, n - 1):
+			gap1, gap2 = gaps[i - 1], gaps[i]
+			left, mid, right = values[i - 1], values[i], values[i + 1]
+			for sign in (1, -1):
+				diff1 = sign * (mid - left)
+				diff2 = sign * (mid - right)
+				if gap1 < max_gap and gap2 < max_gap and (
+						(diff1 > max_bump and diff2 > max_edge)
+						or (diff2 > max_bump and diff1 > max_edge)):
+					values[i] = left + (times[i] - times[i - 1]) / (
+						times[i + 1] - times[i - 1]) * (right - left)
+				if diff1 > max_bump and gap2 >= max_gap:
+					values[i] = left + sign * max_bump
+				if diff2 > max_bump and gap1 >= max_gap:
+					values[i] = right + sign * max_bump
+	values[0] = values[1] + (first - values[1]) / 1000
+	values[-1] = values[-2] + (last - values[-2]) / 1000
+	return values
+
+def smooth(values, width):
+	# Triangular smoothing, with the window cut short and renormalized at
+	# the edges
+	half = width // 2
+	weights = np.concatenate((np.arange(1, half + 2), np.arange(half, 0, -1)))
+	return (np.convolve(values, weights, 'same')
+			/ np.convolve(np.ones(len(values)), weights, 'same'))
+
+def value_at(times, values, t):
+	# Like Praat's PitchTier Get value at time: linear interpolation,
+	# constant beyond the first and last points
+	if len(times) == 0:
+		return np.full(np.shape(t), np.nan)
+	return np.interp(t, times, values)
+
+def parabolic_extremum(times, values, i):
+	# Refines the extremum at values[i] by fitting a parabola through it
+	# and its neighbours, if it's a true local maximum or minimum
+	if 0 < i < len(values) - 1:
+		a, b, c = values[i - 1], values[i], values[i + 1]
+		if (b - a) * (b - c) > 0:
+			shift = 0.5 * (a - c) / (a - 2 * b + c)
+			step = times[i + 1] - times[i]
+			return b - 0.25 * (a - c) * shift, times[i] + shift * step
+	return values[i], times[i]
+
+def interval_stats(times, f0, intensity, starts, ends):
+	"""
+	Computes ProsodyPro's per-interval measurements for the labelled
+	intervals of one speaker, given frame tracks from tracks(). Returns a
+	dictionary of arrays named like the columns of pitchpro_*.tsv.
+	"""
+	starts = np.asarray(starts, dtype=float)
+	ends = np.asarray(ends, dtype=float)
+	n = len(starts)
+
+	# The raw f0 contour: voiced frames, trimmed of spikes
+	voiced = ~np.isnan(f0)
+	f0_times = times[voiced]
+	f0_values = trim(f0_times, f0[voiced])
+
+	# Sample the contour at 100 Hz within every interval, smooth it and
+	# take its velocity in semitones per second
+	counts = np.floor((ends - starts) * F0_SAMPLE_RATE + 1e-9).astype(int) + 1
+	offsets = np.concatenate(([0], np.cumsum(counts)))
+	sample_times = np.repeat(starts, counts) + (
+		np.arange(offsets[-1]) - np.repeat(offsets[:-1], counts)
+	) / F0_SAMPLE_RATE
+	samples = smooth(
+		value_at(f0_times, f0_values, sample_times),
+		int(round(SMOOTHING_WINDOW * F0_SAMPLE_RATE))
+	)
+	semitones = 12 * np.log2(samples)
+
+	velocity_times = []
+	velocity = []
+	for i in range(n):
+		x = np.arange(offsets[i], offsets[i + 1] - 1)
+		x2 = np.where(x + 2 < len(sample_times), x + 2, x + 1)
+		velocity_times.append(sample_times[x])
+		velocity.append(
+			(semitones[x2] - semitones[x]) / (sample_times[x2] - sample_times[x])
+		)
+	velocity_times = np.concatenate(velocity_times)
+	order = np.argsort(velocity_times, kind='stable')
+	velocity_times = velocity_times[order]
+	velocity = trim(velocity_times, np.concatenate(velocity)[order])
+
+	# f0 in 20 ms frames, like ProsodyPro's To Pitch... 0.02, for the
+	# maximum and minimum
+	pitch_times = np.arange(0.01, times[-1] + 0.02, 0.02)
+	pitch = value_at(f0_times, f0_values, pitch_times)
+
+	stats = {name: np.full(n, np.nan) for name in [
+		'maxf0', 'minf0', 'excursion_size', 'meanf0', 'finalf0',
+		'mean_intensity', 'duration', 'max_velocity', 'final_velocity',
+		'maxf0_loc_ms', 'maxf0_loc_ratio', 'minf0_loc_ms', 'minf0_loc_ratio'
+	]}
+	stats['duration'] = 1000 * (ends - starts)
+	stats['finalf0'] = value_at(f0_times, f0_values, ends + FINAL_OFFSET)
+	stats['final_velocity'] = value_at(velocity_times, velocity, ends + FINAL_OFFSET)
+
+	for i in range(n):
+		start, end = starts[i], ends[i]
+		lo, hi = np.searchsorted(f0_times, [start, end], side='left')
+		if hi > lo:
+			stats['meanf0'][i] = f0_values[lo:hi].mean()
+
+		lo, hi = np.searchsorted(pitch_times, [start, end], side='left')
+		if hi > lo:
+			k = lo + pitch[lo:hi].argmax()
+			stats['maxf0'][i], max_time = parabolic_extremum(pitch_times, pitch, k)
+			k = lo + pitch[lo:hi].argmin()
+			stats['minf0'][i], min_time = parabolic_extremum(pitch_times, pitch, k)
+			stats['maxf0_loc_ms'][i] = 1000 * (max_time - start)
+			stats['minf0_loc_ms'][i] = 1000 * (min_time - start)
+
+		lo, hi = np.searchsorted(times, [start, end], side='left')
+		if hi > lo:
+			energy = 10 ** (intensity[lo:hi] / 10)
+			stats['mean_intensity'][i] = 10 * np.log10(np.nanmean(energy))
+
+		lo, hi = np.searchsorted(velocity_times, [start, end], side='left')
+		if hi > lo:
+			stats['max_velocity'][i] = velocity[lo + np.abs(velocity[lo:hi]).argmax()]
+
+	stats['excursion_size'] = 12 * np.log2(stats['maxf0'] / stats['minf0'])
+	stats['maxf0_loc_ratio'] = stats['maxf0_loc_ms'] / stats['duration']
+	stats['minf0_loc_ratio'] = stats['minf0_loc_ms'] / stats['duration']
+	return stats
+
+def tone_check(frequencies=(80, 100, 150, 200, 250, 300, 400, 500),
+			   sample_rate=16000, duration=1.0):
+	"""
+	Runs analyse_frames on synthetic tones (a fundamental and four
+	harmonics at 1/k amplitude) and returns, for each frequency, the
+	fraction of frames whose f0 is within 5% of it. A tracker that picks
+	a multiple of the period reports half the f0 or less and scores 0.
+	"""
+	t = np.arange(int(duration * sample_rate)) / sample_rate
+	times = np.arange(0.05, duration - 0.05, 0.01)
+	result = {}
+	for frequency in frequencies:
+		tone = sum(np.sin(2 * np.pi * k * frequency * t) / k for k in range(1, 6))
+		tone = 0.5 * tone / np.abs(tone).max()
+		f0, _ = analyse_frames(tone[:, None], sample_rate, times, 0.5)
+		result[frequency] = float(np.mean(np.abs(f0 - frequency) < 0.05 * frequency))
+	return result
+
+def compare(stats, reference):
+	"""
+	Measures how well stats agrees with ProsodyPro's values for the same
+	intervals (from prosody.read_pitchpro): for each column, the number of
+	intervals both have a value for, their correlation and the median
+	absolute difference
+	"""
+	agreement = {}
+	for name, values in stats.items():
+		both = np.isfinite(values) & np.isfinite(reference[name])
+		x = values[both]
+		y = reference[name][both]
+		agreement[name] = {
+			'n': int(both.sum()),
+			'correlation': float(np.corrcoef(x, y)[0, 1]) if both.sum() > 1 else None,
+			'median_abs_diff': float(np.median(np.abs(x - y))) if both.any() else None
+		}
+	return agreement
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+		description='Compute ProsodyPro measurements for the syllables of a TextGrid '
+					'from a WAV file'
+	)
+	parser.add_argument('wav', nargs='?')
+	parser.add_argument('textgrid', nargs='?', default=process_textgrid.textgrid_file)
+	parser.add_argument(
+		'--outdir', default='data',
+		help='Where to write acoustics_<speaker>.tsv for each speaker'
+	)
+	parser.add_argument(
+		'--check', action='store_true',
+		help='Compare the results to data/pitchpro_*.tsv instead of writing them'
+	)
+	parser.add_argument(
+		'--tones', action='store_true',
+		help='Check the f0 tracker on synthetic tones instead'
+	)
+	parser.add_argument('-j', '--jobs', type=int, default=1)
+	args = parser.parse_args()
+
+	if args.tones:
+		results = tone_check()
+		for frequency, correct in results.items():
+			print("{} Hz: {:.0%} of frames correct".format(frequency, correct))
+		raise SystemExit(0 if min(results.values()) > 0.95 else 1)
+	if args.wav is None:
+		parser.error('the following arguments are required: wav')
+
+	start = time.time()
+	times, f0, intensity = tracks(args.wav, jobs=args.jobs)
+	print("Analysed {} frames in {:.1f}s".format(len(times), time.time() - start))
+
+	with textgrid_io.TextGridReader(args.textgrid) as reader:
+		table = syllable_features.build_table(process_textgrid.textgrid_columns(reader))
+
+	for speaker, name in prosody.SPEAKERS.items():
+		rows = table['subject'] == speaker
+		stats = interval_stats(
+			times, f0, intensity, table['start_time'][rows], table['end_time'][rows]
+		)
+		if args.check:
+			reference = prosody.read_pitchpro(prosody.PITCHPRO_PATH.format(name))
+			if len(reference['duration']) != rows.sum():
+				print("{}: {} syllables but {} ProsodyPro rows".format(
+					speaker, rows.sum(), len(reference['duration'])
+				))
+				continue
+			print(name)
+			print(json.dumps(compare(stats, reference), indent=1))
+		else:
+			outfile = os.path.join(args.outdir, 'acoustics_{}.tsv'.format(name))
+			with open(outfile, 'w', encoding='utf-8') as f:
+				f.write('\t'.join(['rowLabel'] + list(stats)) + '\n')
+				for i, label in enumerate(table['syllable'][rows]):
+					f.write('\t'.join(
+						[label] + ['--undefined--' if np.isnan(x[i]) else repr(float(x[i]))
+								   for x in stats.values()]
+					) + '\n')
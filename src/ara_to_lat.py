@@ -1,46 +1,251 @@
-import apertium
 import argparse
-import hfst
+import functools
 import io
-import pandas as pd
 import os
 import re
 import time
 
+try:
+	import hfst
+except ImportError:
+	hfst = None
+
 # FST_PATH = "/mnt/e/git_repos/apertium-uig/dev/ortho/ara-lat.hfst"
-FST_PATH = "/home/connor/git_repos/apertium-uig/dev/ortho/ara-lat.hfst"
+FST_PATH = os.environ.get(
+	'UYGHUR_ARA_LAT_FST',
+	"/home/connor/git_repos/apertium-uig/dev/ortho/ara-lat.hfst"
+)
+
+# Marks the start of a word, so that word-initial letters can have their own
+# entries in the table below
+WORD_START = '\0'
+
+# Perso-Arabic (UEY) to Latin (ULY) table used by the built-in transliterator.
+# Multi-letter keys are matched longest-first, which is how word-initial
+# hamza and the ULY apostrophe rules (n'g, s'h, z'h, g'h) are handled.
+ARA_TO_LAT = {
+	'ا': 'a',
+	'ە': 'e',
+	'ه': 'e',
+	'ب': 'b',
+	'پ': 'p',
+	'ت': 't',
+	'ج': 'j',
+	'چ': 'ch',
+	'خ': 'x',
+	'د': 'd',
+	'ر': 'r',
+	'ز': 'z',
+	'ژ': 'zh',
+	'س': 's',
+	'ش': 'sh',
+	'غ': 'gh',
+	'ف': 'f',
+	'ق': 'q',
+	'ك': 'k',
+	'ک': 'k',
+	'گ': 'g',
+	'ڭ': 'ng',
+	'ل': 'l',
+	'م': 'm',
+	'ن': 'n',
+	'ھ': 'h',
+	'و': 'o',
+	'ۇ': 'u',
+	'ۆ': 'ö',
+	'ۈ': 'ü',
+	'ۋ': 'w',
+	'ې': 'é',
+	'ى': 'i',
+	'ي': 'y',
+	'ئ': "'",
+	'،': ',',
+	'؟': '?',
+	'؛': ';',
+	# Hamza is silent at the start of a word
+	WORD_START: '',
+	WORD_START + 'ئ': '',
+	'-ئ': '-',
+	# Letter sequences that would otherwise be read as a Latin digraph
+	'نگ': "n'g",
+	'سھ': "s'h",
+	'زھ': "z'h",
+	'گھ': "g'h"
+}
+
+# Characters the built-in table knows how to handle. Words containing
+# anything else (other than ASCII) are sent to HFST if it's available.
+NATIVE_CHARS = {c for key in ARA_TO_LAT for c in key}
+
+# Trie nodes are dictionaries from characters to child nodes; a node that
+# ends a key stores its output under VALUE
+VALUE = None
+
+def build_trie(table):
+	"""
+	Builds a character trie from a transliteration table
+	"""
+	trie = {}
+	for key, val in table.items():
+		node = trie
+		for c in key:
+			node = node.setdefault(c, {})
+		node[VALUE] = val
+	return trie
+
+ARA_TO_LAT_TRIE = build_trie(ARA_TO_LAT)
+
+def transliterate(word, trie=ARA_TO_LAT_TRIE):
+	"""
+	Converts a Perso-Arabic word to Latin in one longest-match pass over
+	the trie. Characters not in the trie are copied as they are.
+	"""
+	text = WORD_START + word
+	pieces = []
+	i = 0
+	while i < len(text):
+		node = trie
+		j = i
+		match = None
+		while j < len(text) and text[j] in node:
+			node = node[text[j]]
+			j += 1
+			if VALUE in node:
+				match = (j, node[VALUE])
+		if match:
+			i, piece = match
+			pieces.append(piece)
+		else:
+			pieces.append(text[i])
+			i += 1
+	return ''.join(pieces)
+
+def is_native(word):
+	# Whether the built-in table covers every character of word
+	return all(c in NATIVE_CHARS or c.isascii() for c in word)
 
 def load_transducer():
 	"""
-	Loads the orthographic fst we use to convert Perso-Arabic to Latin
-	""" 
+	Loads the orthographic fst we use to convert Perso-Arabic to Latin.
+	Returns None if hfst or the fst file isn't available, in which case
+	the built-in transliterator is used for every word.
+	"""
+	if hfst is None or not os.path.exists(FST_PATH):
+		return None
 	istr = hfst.HfstInputStream(FST_PATH)
 	transducer = istr.read_all()[0]
 	transducer.lookup_optimize()
 	return transducer
 
-def convert_word(transducer, word):
-	if not word or pd.isna(word):
-		return ''
-
+def hfst_convert_word(transducer, word):
+	# Converts a word with the HFST transducer alone
 	parses = transducer.lookup(word)
 	if parses:
 		return parses[1][0]
 	else:
 		return word
 
+# How many words convert_word remembers. It's bounded so that long-running
+# processes (service.py) don't grow without limit.
+WORD_CACHE_SIZE = 100000
+
+class Unkeyed():
+	# Passes a value through an lru_cache without making it part of the
+	# key: all Unkeyed values are equal
+	def __init__(self, value):
+		self.value = value
+
+	def __eq__(self, other):
+		return isinstance(other, Unkeyed)
+
+	def __hash__(self):
+		return 0
+
+@functools.lru_cache(maxsize=WORD_CACHE_SIZE)
+def cached_convert_word(use_transducer, word, transducer):
+	# Token-level cache for convert_word, shared by everything in the
+	# process. Words converted with and without the transducer can differ,
+	# so which was used is part of the key; the transducer itself isn't,
+	# since a process only loads the one at FST_PATH.
+	if use_transducer and not is_native(word):
+		return hfst_convert_word(transducer.value, word)
+	return transliterate(word)
+
+def convert_word(transducer, word):
+	if not isinstance(word, str) or not word:
+		return ''
+	return cached_convert_word(transducer is not None, word, Unkeyed(transducer))
+
+def convert_batch(transducer, words):
+	"""
+	Converts a list of words, converting each distinct word only once
+	"""
+	converted = {word: convert_word(transducer, word) for word in set(words)
+				 if isinstance(word, str)}
+	return [converted.get(word, '') if isinstance(word, str) else ''
+			for word in words]
+
 def convert_sentence(transducer, sentence):
-	if not sentence or pd.isna(sentence):
+	if not isinstance(sentence, str) or not sentence:
 		return ''
 
 	words = sentence.split(' ')
-	parsed_words = [convert_word(transducer, x) for x in words]
-	return ' '.join(parsed_words)
+	return ' '.join(convert_batch(transducer, words))
+
+def benchmark(transducer, words, repeats=5):
+	"""
+	Returns the throughput (words/second) of the built-in transliterator
+	and, if transducer isn't None, of HFST, together with the number of
+	words on which the two disagree
+	"""
+	results = {}
+
+	start = time.perf_counter()
+	for _ in range(repeats):
+		native = [transliterate(word) for word in words]
+	results['native_words_per_sec'] = len(words) * repeats / (time.perf_counter() - start)
+
+	start = time.perf_counter()
+	for _ in range(repeats):
+		cached_convert_word.cache_clear()
+		convert_batch(None, words)
+	results['batch_words_per_sec'] = len(words) * repeats / (time.perf_counter() - start)
+
+	if transducer is not None:
+		start = time.perf_counter()
+		for _ in range(repeats):
+			hfst_words = [hfst_convert_word(transducer, word) for word in words]
+		results['hfst_words_per_sec'] = len(words) * repeats / (time.perf_counter() - start)
+		results['disagreements'] = sum(
+			1 for (x, y) in zip(native, hfst_words) if x != y
+		)
+
+	return results
 
 if __name__ == "__main__":
-	data = pd.read_csv('data/oovs.txt', header=None)
+	import pandas as pd
+
+	parser = argparse.ArgumentParser(
+		description='Convert the label_wd and label_st columns of a gesture '
+					'spreadsheet from Perso-Arabic to Latin'
+	)
+	parser.add_argument('infile', nargs='?', default='data/uyghur_gesture_youtube.csv')
+	parser.add_argument('outfile', nargs='?', default='data/uyghur_gesture_youtube_lat.csv')
+	parser.add_argument(
+		'--benchmark', action='store_true',
+		help='Time the built-in transliterator against HFST instead'
+	)
+	args = parser.parse_args()
+
+	data = pd.read_csv(args.infile)
 	transducer = load_transducer()
-	breakpoint()
-	data['label_wd'] = data.label_wd.apply(lambda x: convert_word(transducer, x))
-	data['label_st'] = data.label_st.apply(lambda x: convert_sentence(transducer, x))
-	data.to_csv('uyghur_gesture_youtube_lat.csv')
\ No newline at end of file
+
+	if args.benchmark:
+		words = [
+			word for sentence in data.label_st.dropna() for word in sentence.split(' ')
+		] + list(data.label_wd.dropna())
+		print(benchmark(transducer, words))
+	else:
+		data['label_wd'] = convert_batch(transducer, list(data.label_wd))
+		data['label_st'] = data.label_st.apply(lambda x: convert_sentence(transducer, x))
+		data.to_csv(args.outfile)
@@ -0,0 +1,376 @@
+from itertools import product
+from Semiring import GenericAutomaton, BoolSemiring, gfsa2
+from syllabifier import Syllabifier, SetOfStringsSemiring, get_syllabifier
+import tokenizer
+
+# Operations that build new automata out of GenericAutomatons:
+#
+#   trim:        removes the states that aren't on any successful path
+#   determinize: subset construction for Bool automata, and determinization
+#                of functional string transducers (SetOfStringsSemiring
+#                automata in which each input has at most one output)
+#   minimize:    the smallest deterministic automaton with the same values
+#   intersect:   restricts an automaton to the inputs an acceptor accepts,
+#                so a constraint like gfsa2 can be compiled into the
+#                syllabifier instead of being checked after parsing
+#
+# All of them return automata of the same kind as they're given (a
+# Syllabifier stays a Syllabifier), and keep the states in their original
+# order where they can, so that the order of the parses doesn't change.
+
+def _rebuild(automaton, starts, ends, deltas, states=None):
+    if isinstance(automaton, Syllabifier):
+        cls = Syllabifier
+    else:
+        cls = GenericAutomaton
+    return cls(starts, ends, deltas, automaton.sr, states=states)
+
+def symbols(automaton):
+    # The input symbols of automaton, in order of first appearance
+    found = {}
+    for (_, x, _, _) in automaton.deltas:
+        found.setdefault(x, None)
+    return list(found)
+
+def common_prefix(strings):
+    strings = list(strings)
+    if not strings:
+        return ''
+    shortest = min(strings, key=len)
+    for i, c in enumerate(shortest):
+        if any(s[i] != c for s in strings):
+            return shortest[:i]
+    return shortest
+
+def _reachable(roots, neighbours):
+    # Every state reachable from roots
+    seen = set(roots)
+    stack = list(roots)
+    while stack:
+        q = stack.pop()
+        for q1 in neighbours.get(q, []):
+            if q1 not in seen:
+                seen.add(q1)
+                stack.append(q1)
+    return seen
+
+def trim(automaton):
+    """
+    Returns a copy of automaton without the states that can't be reached
+    from an initial state or can't reach a final one, and without weights
+    equal to gfalse. The value of every sequence stays the same.
+    """
+    sr = automaton.sr
+    forward = {}
+    backward = {}
+    for (q1, x, p, q2) in automaton.deltas:
+        if p != sr.gfalse:
+            forward.setdefault(q1, []).append(q2)
+            backward.setdefault(q2, []).append(q1)
+
+    accessible = _reachable(
+        [q for (q, v) in automaton.starts if v != sr.gfalse], forward
+    )
+    coaccessible = _reachable(
+        [q for (q, v) in automaton.ends if v != sr.gfalse], backward
+    )
+    useful = accessible & coaccessible
+
+    return _rebuild(
+        automaton,
+        starts = [(q, v) for (q, v) in automaton.starts
+                  if q in useful and v != sr.gfalse],
+        ends = [(q, v) for (q, v) in automaton.ends
+                if q in useful and v != sr.gfalse],
+        deltas = [(q1, x, p, q2) for (q1, x, p, q2) in automaton.deltas
+                  if q1 in useful and q2 in useful and p != sr.gfalse],
+        states = [q for q in automaton.all_states() if q in useful]
+    )
+
+def is_deterministic(automaton):
+    # Whether automaton has at most one initial state and at most one
+    # transition for each state and symbol (with a single output string,
+    # for string automata)
+    sr = automaton.sr
+    strings = isinstance(sr, SetOfStringsSemiring)
+    states = automaton.all_states()
+    initial = [q for q in states if automaton.init(q) != sr.gfalse]
+    if len(initial) > 1:
+        return False
+    for q in states:
+        weights = [automaton.init(q), automaton.fin(q)]
+        for x in symbols(automaton):
+            arcs = automaton.arcs(q, x)
+            if len(arcs) > 1:
+                return False
+            weights.extend(p for (p, _) in arcs)
+        if strings and any(len(v) > 1 for v in weights):
+            return False
+    return True
+
+def determinize_bool(automaton):
+    # The subset construction. State i of the result is the i-th subset of
+    # automaton's states found, starting from the set of initial states.
+    sr = automaton.sr
+    start = frozenset(q for q in automaton.all_states()
+                      if automaton.init(q) != sr.gfalse)
+    if not start:
+        return _rebuild(automaton, [], [], [])
+
+    ids = {start: 0}
+    queue = [start]
+    ends = []
+    deltas = []
+    for subset in queue:
+        if any(automaton.fin(q) != sr.gfalse for q in subset):
+            ends.append((ids[subset], sr.gtrue))
+        for x in symbols(automaton):
+            target = frozenset(q1 for q in subset for (_, q1) in automaton.arcs(q, x))
+            if not target:
+                continue
+            if target not in ids:
+                ids[target] = len(ids)
+                queue.append(target)
+            deltas.append((ids[subset], x, sr.gtrue, ids[target]))
+
+    return _rebuild(automaton, [(0, sr.gtrue)], ends, deltas)
+
+def determinize_strings(automaton, max_states=100000):
+    """
+    Determinizes a functional string transducer. Each state of the result
+    is a set of (state, residual) pairs: the states the input so far can
+    lead to, and the output owed on each path beyond what's already been
+    written, which is the longest common prefix of the paths' outputs.
+
+    Raises an exception if some input has more than one output, as with
+    the syllabifier, whose words often have several parses. Functional
+    transducers can still have no deterministic equivalent, when the
+    residuals keep growing; this gives up after max_states states.
+    """
+    automaton = trim(automaton)
+    sr = automaton.sr
+
+    def not_functional(where):
+        return Exception(
+            "Can't determinize: an input has more than one output ({})".format(where)
+        )
+
+    initial = {}
+    for q in automaton.all_states():
+        for s in automaton.init(q):
+            if initial.setdefault(q, s) != s:
+                raise not_functional("initial weight of {}".format(q))
+    if not initial:
+        return _rebuild(automaton, [], [], [])
+
+    prefix = common_prefix(initial.values())
+    start = frozenset((q, s[len(prefix):]) for (q, s) in initial.items())
+    ids = {start: 0}
+    queue = [start]
+    ends = []
+    deltas = []
+    for subset in queue:
+        outputs = {r + f for (q, r) in subset for f in automaton.fin(q)}
+        if len(outputs) > 1:
+            raise not_functional("final outputs {}".format(sorted(outputs)))
+        if outputs:
+            ends.append((ids[subset], list(outputs)))
+
+        for x in symbols(automaton):
+            residuals = {}
+            for (q, r) in subset:
+                for (p, q1) in automaton.arcs(q, x):
+                    for s in p:
+                        # In a trimmed automaton q1 can reach a final state,
+                        # so two different residuals mean two outputs
+                        if residuals.setdefault(q1, r + s) != r + s:
+                            raise not_functional("{} on {}".format(q1, x))
+            if not residuals:
+                continue
+
+            out = common_prefix(residuals.values())
+            target = frozenset((q1, w[len(out):]) for (q1, w) in residuals.items())
+            if target not in ids:
+                if len(ids) >= max_states:
+                    raise Exception(
+                        "Can't determinize: no deterministic equivalent with "
+                        "fewer than {} states".format(max_states)
+                    )
+                ids[target] = len(ids)
+                queue.append(target)
+            deltas.append((ids[subset], x, [out], ids[target]))
+
+    return _rebuild(automaton, [(0, [prefix])], ends, deltas)
+
+def determinize(automaton):
+    if isinstance(automaton.sr, BoolSemiring):
+        return determinize_bool(automaton)
+    if isinstance(automaton.sr, SetOfStringsSemiring):
+        return determinize_strings(automaton)
+    raise Exception(
+        "determinize only supports Bool and SetOfStrings semirings"
+    )
+
+def push(automaton):
+    """
+    Moves the output of a deterministic string transducer as close to the
+    initial state as possible: each state's outgoing transitions and final
+    output lose the longest prefix they all share, which is written on the
+    way into the state instead. Equivalent states then have identical
+    transitions, which is what minimize needs.
+    """
+    states = automaton.all_states()
+    xs = symbols(automaton)
+
+    # prefix[q] is the longest common prefix of every output from q to a
+    # final state. It's found by iterating to a fixpoint; each value only
+    # ever gets shorter.
+    prefix = {q: None for q in states}
+    changed = True
+    while changed:
+        changed = False
+        for q in states:
+            candidates = list(automaton.fin(q))
+            for x in xs:
+                for (p, q1) in automaton.arcs(q, x):
+                    if prefix[q1] is not None:
+                        candidates.append(p[0] + prefix[q1])
+            if candidates:
+                new = common_prefix(candidates)
+                if new != prefix[q]:
+                    prefix[q] = new
+                    changed = True
+
+    return _rebuild(
+        automaton,
+        starts = [(q, [s + prefix[q] for s in v]) for (q, v) in automaton.starts],
+        ends = [(q, [f[len(prefix[q]):] for f in v]) for (q, v) in automaton.ends],
+        deltas = [(q1, x, [(s + prefix[q2])[len(prefix[q1]):] for s in p], q2)
+                  for (q1, x, p, q2) in automaton.deltas],
+        states = states
+    )
+
+def minimize(automaton):
+    """
+    Returns the minimal deterministic automaton equivalent to automaton (a
+    Bool automaton or a functional string transducer), determinizing it
+    first if it isn't deterministic. States that can't be told apart by
+    any input are merged by partition refinement; state i of the result is
+    the i-th class found, in the order of the original states.
+    """
+    if not is_deterministic(automaton):
+        automaton = determinize(automaton)
+    automaton = trim(automaton)
+    strings = isinstance(automaton.sr, SetOfStringsSemiring)
+    if strings:
+        automaton = push(automaton)
+
+    sr = automaton.sr
+    states = automaton.all_states()
+    xs = symbols(automaton)
+
+    def label(v):
+        # What a weight contributes to a state's signature
+        if v == sr.gfalse:
+            return None
+        return v[0] if strings else True
+
+    def renumber(signatures):
+        ids = {}
+        return {q: ids.setdefault(signatures[q], len(ids)) for q in states}
+
+    block = renumber({q: label(automaton.fin(q)) for q in states})
+    while True:
+        signatures = {
+            q: (block[q],) + tuple(
+                (x, label(p), block[q1])
+                for x in xs for (p, q1) in automaton.arcs(q, x)
+            )
+            for q in states
+        }
+        refined = renumber(signatures)
+        if len(set(refined.values())) == len(set(block.values())):
+            break
+        block = refined
+
+    representative = {}
+    for q in states:
+        representative.setdefault(block[q], q)
+    starts = [(block[q], automaton.init(q)) for q in states
+              if automaton.init(q) != sr.gfalse]
+    ends = [(b, automaton.fin(q)) for (b, q) in representative.items()
+            if automaton.fin(q) != sr.gfalse]
+    deltas = [(b, x, p, block[q1]) for (b, q) in representative.items()
+              for x in xs for (p, q1) in automaton.arcs(q, x)]
+    return _rebuild(automaton, starts, ends, deltas, states=sorted(representative))
+
+def intersect(automaton, acceptor, symbol_map=None):
+    """
+    Restricts automaton to the sequences acceptor (a Bool automaton)
+    accepts, keeping automaton's weights. symbol_map, if given, maps each
+    symbol of automaton to the symbol the acceptor reads in its place (e.g.
+    letters to C and V for gfsa2), or to None for symbols the acceptor
+    should skip.
+
+    The states of the result are pairs (state of automaton, state of the
+    determinized acceptor), ordered by the first and then the second, so a
+    Syllabifier's parses of the sequences that are left come out in the
+    same order as before.
+    """
+    if not is_deterministic(acceptor):
+        acceptor = determinize(acceptor)
+    sr = automaton.sr
+    if symbol_map is None:
+        symbol_map = lambda x: x
+
+    def acceptor_arcs(r, x):
+        y = symbol_map(x)
+        if y is None:
+            return [r]
+        return [r1 for (p, r1) in acceptor.arcs(r, y) if p]
+
+    initial = [(q, r) for (q, r) in product(automaton.all_states(), acceptor.all_states())
+               if automaton.init(q) != sr.gfalse and acceptor.init(r)]
+    seen = set(initial)
+    queue = list(initial)
+    deltas = []
+    for (q, r) in queue:
+        for x in symbols(automaton):
+            for (p, q1) in automaton.arcs(q, x):
+                for r1 in acceptor_arcs(r, x):
+                    deltas.append(((q, r), x, p, (q1, r1)))
+                    if (q1, r1) not in seen:
+                        seen.add((q1, r1))
+                        queue.append((q1, r1))
+
+    order = {q: i for (i, q) in enumerate(automaton.all_states())}
+    acceptor_order = {r: i for (i, r) in enumerate(acceptor.all_states())}
+    states = sorted(seen, key=lambda pair: (order[pair[0]], acceptor_order[pair[1]]))
+    return trim(_rebuild(
+        automaton,
+        starts = [(pair, automaton.init(pair[0])) for pair in states if pair in initial],
+        ends = [(pair, automaton.fin(pair[0])) for pair in states
+                if automaton.fin(pair[0]) != sr.gfalse and acceptor.fin(pair[1])],
+        deltas = deltas,
+        states = states
+    ))
+
+def size(automaton):
+    # (states, transitions)
+    return len(automaton.all_states()), len(automaton.deltas)
+
+if __name__ == "__main__":
+    syller = get_syllabifier()
+    print("syllabifier: {} states, {} transitions".format(*size(syller)))
+    print("trimmed: {} states, {} transitions".format(*size(trim(syller))))
+    print("gfsa2: {} states, {} transitions".format(*size(gfsa2)))
+    print("gfsa2 minimized: {} states, {} transitions".format(*size(minimize(gfsa2))))
+
+    # The syllabifier restricted to words with two consonants or two vowels
+    vowels = set('aeiouüöé')
+    cv = lambda x: None if x in "'-" else ('V' if x in vowels else 'C')
+    restricted = intersect(syller, gfsa2, cv)
+    print("syllabifier x gfsa2: {} states, {} transitions".format(*size(restricted)))
+    for word in ['kitab', 'mektep', 'aile', 'kitabxana']:
+        simple = tokenizer.latin_to_simple.convert(word)
+        print(word, syller.first_parse(simple), restricted.first_parse(simple))
@@ -0,0 +1,316 @@
+import argparse
+import ara_to_lat
+import csv
+import datetime
+import json
+import matrix_automaton
+import os
+import platform
+import process_textgrid
+import pron_dict
+import statistics
+import subprocess
+import sys
+import syllabifier
+import syllabify_textgrid
+import syllable_features
+import tempfile
+import textgrid_io
+import time
+import tokenizer
+from Semiring import BoolSemiring, DoubleSemiring, gfsa1, gfsa2
+
+# Benchmarks for the automata, the transliterator and the TextGrid pipeline.
+# Run from the top of the repository:
+#
+#     python src/benchmarks.py
+#
+# writes the timings to data/.benchmarks/<date>_<commit>.json, and
+#
+#     python src/benchmarks.py --compare data/.benchmarks/<earlier>.json
+#
+# also prints how each benchmark changed since the earlier run, and exits
+# with an error if any got slower by more than --threshold.
+#
+# Each benchmark is a named function called repeatedly; its result gives the
+# best and median time per call over the repeats, and per item (word,
+# sentence, file...) where a call handles more than one. Comparisons use
+# the best time, which is the least affected by other load on the machine.
+
+OUTPUT_DIR = 'data/.benchmarks'
+TEXTGRID_DIR = 'data/textgrids_to_syllabify'
+UTTERANCE_PATH = 'data/uyghur_gesture_youtube.csv'
+
+# Buckets of word lengths (in symbols) for the automaton benchmarks, and how
+# many words of each bucket are evaluated per call
+LENGTH_BUCKETS = [(1, 4), (5, 8), (9, 12), (13, 20)]
+WORDS_PER_BUCKET = 50
+
+# Sizes of the lists given to the Semiring reductions. A RecursionError
+# (which the recursive versions of these raised at around 1000 elements) is
+# recorded as the benchmark's error.
+SEMIRING_SIZES = [16, 128, 512, 2048, 16384]
+
+def measure(function, repeats=5, min_seconds=0.2):
+	"""
+	Times function(). The number of calls per repeat is doubled until a
+	repeat takes at least min_seconds, and the fastest and median time per
+	call are returned.
+	"""
+	number = 1
+	while True:
+		start = time.perf_counter()
+		for _ in range(number):
+			function()
+		elapsed = time.perf_counter() - start
+		if elapsed >= min_seconds or number >= 2**20:
+			break
+		number *= 2
+
+	times = [elapsed / number]
+	for _ in range(repeats - 1):
+		start = time.perf_counter()
+		for _ in range(number):
+			function()
+		times.append((time.perf_counter() - start) / number)
+	return {
+		'number': number,
+		'repeats': repeats,
+		'best': min(times),
+		'median': statistics.median(times)
+	}
+
+def clear_caches():
+	# Empties the process-wide conversion caches, so that every call does
+	# the full amount of work
+	ara_to_lat.cached_convert_word.cache_clear()
+	for converter in (tokenizer.ipa_to_latin, tokenizer.latin_to_simple, tokenizer.simple_to_latin):
+		converter.convert.cache_clear()
+
+def bucket_words(words):
+	# Up to WORDS_PER_BUCKET distinct words from each length bucket, spread
+	# evenly over words so the sample doesn't depend on dictionary order
+	buckets = {}
+	for low, high in LENGTH_BUCKETS:
+		found = sorted({w for w in words if low <= len(w) <= high})
+		step = max(1, len(found) // WORDS_PER_BUCKET)
+		buckets['{}-{}'.format(low, high)] = found[::step][:WORDS_PER_BUCKET]
+	return buckets
+
+def automaton_inputs():
+	"""
+	Returns the words from uyghur_cv.dict in each automaton's alphabet: for
+	the syllabifier the Latin spellings with single-symbol digraphs, for
+	gfsa2 the CV skeletons of the pronunciations, and for gfsa1 the Latin
+	spellings with letters outside its alphabet left out
+	"""
+	latin = [ara_to_lat.transliterate(word) for (word, _) in pron_dict.read_dict()]
+	gfsa1_symbols = {x for (_, x, _, _) in gfsa1.deltas}
+	return {
+		'syllabifier': [tokenizer.latin_to_simple.convert(word) for word in latin],
+		'gfsa1': [''.join(c for c in word if c in gfsa1_symbols) for word in latin],
+		'gfsa2': matrix_automaton.read_cv_lexicon(pron_dict.DICT_PATH)
+	}
+
+def automaton_benchmarks():
+	inputs = automaton_inputs()
+	automata = {
+		'syllabifier': syllabifier.get_syllabifier(),
+		'gfsa1': gfsa1,
+		'gfsa2': gfsa2
+	}
+	for name, automaton in automata.items():
+		for bucket, words in bucket_words(inputs[name]).items():
+			for method in ('val_b', 'val_f'):
+				evaluate = getattr(automaton, method)
+				yield (
+					'automata/{}/{}/{}'.format(name, method, bucket),
+					lambda evaluate=evaluate, words=words: [evaluate(w) for w in words],
+					len(words)
+				)
+
+def semiring_benchmarks():
+	semirings = {'double': (DoubleSemiring(), 0.5), 'bool': (BoolSemiring(), True)}
+	for name, (sr, value) in semirings.items():
+		for size in SEMIRING_SIZES:
+			values = [value] * size
+			cases = {
+				'big_gconj': lambda sr=sr, values=values: sr.big_gconj(values),
+				'big_gdisj': lambda sr=sr, values=values: sr.big_gdisj(values),
+				'dotprod': lambda sr=sr, values=values: sr.dotprod(values, values),
+				'expn': lambda sr=sr, value=value, size=size: sr.expn(value, size)
+			}
+			for operation, function in cases.items():
+				yield 'semiring/{}/{}/{}'.format(name, operation, size), function, size
+
+def read_utterances(infile=UTTERANCE_PATH):
+	with open(infile, newline='', encoding='utf-8-sig') as f:
+		return sorted({row['label_st'] for row in csv.DictReader(f) if row['label_st']})
+
+def transliteration_benchmarks():
+	sentences = read_utterances()
+	transducer = ara_to_lat.load_transducer()
+
+	def convert_all():
+		clear_caches()
+		for sentence in sentences:
+			ara_to_lat.convert_sentence(transducer, sentence)
+
+	yield 'transliterate/convert_sentence', convert_all, len(sentences)
+
+def pipeline_benchmarks():
+	"""
+	Syllabifies each TextGrid in TEXTGRID_DIR and extracts its syllable
+	table, as syllabify_textgrid.py and process_textgrid.py do, with the
+	conversion caches emptied first. Writing the syllabified TextGrid is
+	timed separately.
+	"""
+	transducer = ara_to_lat.load_transducer()
+	syller = syllabifier.get_syllabifier()
+
+	def syllabify_and_extract(path):
+		clear_caches()
+		textgrid = syllabify_textgrid.read_textgrid(path)
+		syllabify_textgrid.syllabify_textgrid(textgrid, transducer, syller)
+		table = syllable_features.build_table(process_textgrid.textgrid_columns(textgrid))
+		return textgrid, table
+
+	with tempfile.TemporaryDirectory() as outdir:
+		for path in syllabify_textgrid.find_textgrids([TEXTGRID_DIR]):
+			name = os.path.splitext(os.path.basename(path))[0]
+			outfile = os.path.join(outdir, name + '.TextGrid')
+			textgrid, _ = syllabify_and_extract(path)
+			yield (
+				'pipeline/syllabify_and_extract/' + name,
+				lambda path=path: syllabify_and_extract(path),
+				1
+			)
+			yield (
+				'pipeline/write/' + name,
+				lambda textgrid=textgrid, outfile=outfile: textgrid_io.write_textgrid(textgrid, outfile),
+				1
+			)
+
+SUITES = {
+	'automata': automaton_benchmarks,
+	'semiring': semiring_benchmarks,
+	'transliterate': transliteration_benchmarks,
+	'pipeline': pipeline_benchmarks
+}
+
+def run(suites, repeats=5, min_seconds=0.2, pattern=None):
+	# Runs the benchmarks of the named suites, yielding (name, result)
+	# for each as it finishes
+	for suite in suites:
+		for name, function, items in SUITES[suite]():
+			if pattern and pattern not in name:
+				continue
+			try:
+				result = measure(function, repeats, min_seconds)
+			except RecursionError:
+				result = {'error': 'RecursionError'}
+			else:
+				result['items'] = items
+				result['best_per_item'] = result['best'] / items
+			yield name, result
+
+def git_commit():
+	try:
+		return subprocess.run(
+			['git', 'rev-parse', '--short', 'HEAD'],
+			capture_output=True, text=True, check=True
+		).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def environment():
+	return {
+		'commit': git_commit(),
+		'date': datetime.datetime.now().isoformat(timespec='seconds'),
+		'python': platform.python_version(),
+		'platform': platform.platform(),
+		'cpus': os.cpu_count()
+	}
+
+def compare(results, previous, threshold):
+	"""
+	Returns (name, ratio) for every benchmark in both results and previous,
+	where ratio is the new best time over the old one, and the names of
+	those that got slower by more than threshold (e.g. 0.2 for 20%)
+	"""
+	ratios = []
+	regressions = []
+	for name, result in results.items():
+		old = previous.get(name)
+		if not old or 'best' not in old or 'best' not in result:
+			continue
+		ratio = result['best'] / old['best']
+		ratios.append((name, ratio))
+		if ratio > 1 + threshold:
+			regressions.append(name)
+	return ratios, regressions
+
+def format_seconds(seconds):
+	for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+		if seconds >= scale:
+			return '{:.3g} {}'.format(seconds / scale, unit)
+	return '{:.3g} ns'.format(seconds / 1e-9)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+		description='Time the automata, the transliterator and the TextGrid pipeline'
+	)
+	parser.add_argument(
+		'suites', nargs='*', default=list(SUITES),
+		help='Which suites to run: {} (default: all)'.format(', '.join(SUITES))
+	)
+	parser.add_argument('-k', dest='pattern', default=None,
+						help='Only run benchmarks whose name contains this')
+	parser.add_argument('--repeats', type=int, default=5)
+	parser.add_argument('--min-seconds', type=float, default=0.2,
+						help='Minimum length of each repeat')
+	parser.add_argument('--output', default=None,
+						help='Where to write the results (default: {}/<date>_<commit>.json)'.format(OUTPUT_DIR))
+	parser.add_argument('--compare', default=None,
+						help='Earlier results file to compare against')
+	parser.add_argument('--threshold', type=float, default=0.2,
+						help='Slowdown that counts as a regression (default: 0.2)')
+	args = parser.parse_args()
+	for suite in args.suites:
+		if suite not in SUITES:
+			parser.error("unknown suite {}".format(suite))
+
+	env = environment()
+	results = {}
+	for name, result in run(args.suites, args.repeats, args.min_seconds, args.pattern):
+		results[name] = result
+		if 'error' in result:
+			print("{:72} {}".format(name, result['error']))
+		else:
+			print("{:72} {:>10} per call  {:>10} per item".format(
+				name, format_seconds(result['best']), format_seconds(result['best_per_item'])
+			))
+
+	output = args.output
+	if output is None:
+		os.makedirs(OUTPUT_DIR, exist_ok=True)
+		output = os.path.join(OUTPUT_DIR, '{}_{}.json'.format(
+			env['date'].replace(':', '-'), env['commit'] or 'unknown'
+		))
+	with open(output, 'w', encoding='utf-8') as f:
+		json.dump({'environment': env, 'results': results}, f, indent=1)
+	print("Wrote {}".format(output))
+
+	if args.compare:
+		with open(args.compare, encoding='utf-8') as f:
+			previous = json.load(f)
+		ratios, regressions = compare(results, previous['results'], args.threshold)
+		print("\nCompared with {} ({}):".format(args.compare, previous['environment']['commit']))
+		for name, ratio in ratios:
+			print("{:72} {:6.2f}x{}".format(
+				name, ratio, '  REGRESSION' if name in regressions else ''
+			))
+		if regressions:
+			sys.exit("{} benchmarks got slower by more than {:.0%}".format(
+				len(regressions), args.threshold
+			))
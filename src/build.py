@@ -0,0 +1,299 @@
+import argparse
+import hashlib
+import json
+import numpy as np
+import os
+import process_textgrid
+import syllabify_textgrid
+import syllable_features
+import textgrid_io
+import time
+
+# Incremental rebuild of the syllabified TextGrids and syllable_data.csv.
+#
+# A manifest records, for every output, the content hash of its input and
+# the version of the code that produced it, where the version of a
+# component is a hash of its source files. An output is rebuilt only when
+# one of those has changed. The syllable table is kept as one fragment per
+# (source TextGrid, speaker), keyed on the contents of that speaker's word
+# and syllable tiers, so fixing one speaker's annotation only recomputes
+# that speaker's rows before the fragments are concatenated again.
+#
+# Outputs go under data/.build by default, not over the committed files in
+# data/, some of which have been corrected by hand. The manifest also
+# records the hash of every output the build writes, and an output that
+# doesn't match it (one that was adopted, or edited since) is never replaced
+# without --force.
+
+BUILD_DIR = 'data/.build'
+MANIFEST_PATH = os.path.join(BUILD_DIR, 'manifest.json')
+FRAGMENT_DIR = os.path.join(BUILD_DIR, 'fragments')
+OUTPUT_DIR = os.path.join(BUILD_DIR, 'syllabified_textgrids')
+TABLE_PATH = os.path.join(BUILD_DIR, 'syllable_data.csv')
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Source files each component depends on
+COMPONENTS = {
+	'syllabifier': [
+		'Semiring.py', 'syllabifier.py', 'compiled_syllabifier.py',
+		'automaton_ops.py', 'syllabify_textgrid.py', 'textgrid_io.py',
+		'tier_alignment.py', 'tokenizer.py'
+	],
+	'transliterator': ['ara_to_lat.py'],
+	'features': [
+		'process_textgrid.py', 'syllable_features.py', 'textgrid_io.py',
+		'tier_alignment.py', 'tokenizer.py'
+	]
+}
+
+def file_hash(path):
+	h = hashlib.sha1()
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(1 << 20), b''):
+			h.update(block)
+	return h.hexdigest()
+
+def code_versions():
+	versions = {}
+	for component, files in COMPONENTS.items():
+		h = hashlib.sha1()
+		for name in files:
+			h.update(file_hash(os.path.join(SRC_DIR, name)).encode())
+		versions[component] = h.hexdigest()
+	return versions
+
+def load_manifest(path=MANIFEST_PATH):
+	manifest = {'textgrids': {}, 'tables': {}, 'outputs': {}}
+	if os.path.exists(path):
+		with open(path, encoding='utf-8') as f:
+			manifest.update(json.load(f))
+	return manifest
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+	# Written to a temporary file first so an interrupted build can't leave
+	# a truncated manifest behind
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path + '.tmp', 'w', encoding='utf-8') as f:
+		json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+	os.replace(path + '.tmp', path)
+
+def replaceable(manifest, path):
+	# Whether path can be (over)written: it doesn't exist, or it's exactly
+	# what the build last wrote there
+	return (not os.path.exists(path)
+			or manifest['outputs'].get(path) == file_hash(path))
+
+def record_output(manifest, path):
+	manifest['outputs'][path] = file_hash(path)
+
+def build_textgrids(manifest, versions, paths, outdir, jobs=None, force=False):
+	"""
+	Syllabifies the TextGrids in paths whose contents, or the syllabifier or
+	transliterator code, have changed since they were last built. Outputs
+	that already exist but aren't in the manifest yet are adopted as they
+	are rather than overwritten, since they may have been corrected by
+	hand, and so are outputs edited since the build wrote them: they're
+	reported and left stale. force rebuilds everything. Returns the reports
+	of the files that were rebuilt.
+	"""
+	# Entries are keyed on the output, since the same input can be built
+	# into more than one directory
+	entries = manifest['textgrids']
+	stale = []
+	for textgrid_file in syllabify_textgrid.find_textgrids(paths):
+		outname = syllabify_textgrid.output_path(textgrid_file, outdir)
+		entry = {
+			'source': textgrid_file,
+			'input': file_hash(textgrid_file),
+			'syllabifier': versions['syllabifier'],
+			'transliterator': versions['transliterator']
+		}
+		old = entries.get(outname)
+		if force or not os.path.exists(outname):
+			stale.append((textgrid_file, (outname, entry)))
+		elif old is None:
+			print("Adopting existing {}".format(outname))
+			entries[outname] = entry
+		elif any(old.get(key) != value for key, value in entry.items()):
+			if replaceable(manifest, outname):
+				stale.append((textgrid_file, (outname, entry)))
+			else:
+				print("Not replacing {}, which was adopted or has been edited "
+					  "(use --force to rebuild it)".format(outname))
+
+	if not stale:
+		return []
+
+	reports = []
+	stale_entries = dict(stale)
+	for report in syllabify_textgrid.run(list(stale_entries), outdir, jobs):
+		reports.append(report)
+		# Failed files stay out of the manifest so they're retried next time
+		outname, entry = stale_entries[report['file']]
+		if 'error' in report:
+			entries.pop(outname, None)
+		else:
+			entries[outname] = entry
+			record_output(manifest, outname)
+	return reports
+
+def syllabified_outputs(paths, outdir):
+	# The syllabified TextGrids build_textgrids writes for the TextGrids in
+	# paths (those that exist, so files that failed are left out), which are
+	# what the syllable table is built from by default
+	outputs = [
+		syllabify_textgrid.output_path(textgrid_file, outdir)
+		for textgrid_file in syllabify_textgrid.find_textgrids(paths)
+	]
+	return [x for x in outputs if os.path.exists(x)]
+
+def tier_hash(*tiers):
+	h = hashlib.sha1()
+	for tier in tiers:
+		h.update(repr([
+			(x.start_time, x.end_time, x.text) for x in tier
+		]).encode('utf-8'))
+	return h.hexdigest()
+
+def fragment_path(source, speaker_prefix):
+	key = hashlib.sha1('{}\0{}'.format(source, speaker_prefix).encode('utf-8'))
+	return os.path.join(FRAGMENT_DIR, key.hexdigest() + '.npz')
+
+def save_fragment(table, path):
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path, 'wb') as f:
+		np.savez(f, **table)
+
+def load_fragment(path):
+	with np.load(path) as fragment:
+		return {name: fragment[name] for name in fragment.files}
+
+def build_table(manifest, versions, sources, outfile, force=False):
+	"""
+	Brings outfile up to date with the syllable tiers of sources. Sources
+	that haven't changed aren't read at all; in those that have, only the
+	speakers whose tiers differ are re-extracted. Returns the number of
+	speakers that were re-extracted.
+	"""
+	entries = manifest['tables'].setdefault(outfile, {})
+	rebuilt = 0
+	changed = (force or set(entries) != set(sources)
+			   or not os.path.exists(outfile) or not replaceable(manifest, outfile))
+
+	for source in sources:
+		source_hash = file_hash(source)
+		old = entries.get(source, {})
+		fragments_exist = all(
+			os.path.exists(x['fragment']) for x in old.get('speakers', [])
+		)
+		if (not force and old.get('input') == source_hash
+				and old.get('features') == versions['features'] and fragments_exist):
+			continue
+
+		changed = True
+		old_speakers = {
+			x['prefix']: x for x in old.get('speakers', [])
+			if old.get('features') == versions['features']
+		}
+		speakers = []
+		with textgrid_io.TextGridReader(source) as reader:
+			source_speakers = list(process_textgrid.speaker_tiers(reader))
+		for speaker_prefix, tier, word_tier in source_speakers:
+			speaker = {
+				'prefix': speaker_prefix,
+				'tiers': tier_hash(tier, word_tier),
+				'fragment': fragment_path(source, speaker_prefix)
+			}
+			previous = old_speakers.get(speaker_prefix)
+			if (force or previous is None or previous['tiers'] != speaker['tiers']
+					or not os.path.exists(speaker['fragment'])):
+				columns = process_textgrid.speaker_columns(speaker_prefix, tier, word_tier)
+				table = syllable_features.build_table(columns)
+				syllable_features.check_table(table)
+				save_fragment(table, speaker['fragment'])
+				rebuilt += 1
+			speakers.append(speaker)
+
+		entries[source] = {
+			'input': source_hash,
+			'features': versions['features'],
+			'speakers': speakers
+		}
+
+	for source in list(entries):
+		if source not in sources:
+			del entries[source]
+
+	if changed and not (force or replaceable(manifest, outfile)):
+		print("Not replacing {}, which wasn't written by this build or has been "
+			  "edited (use --force to rebuild it)".format(outfile))
+	elif changed:
+		fragments = [
+			load_fragment(speaker['fragment'])
+			for source in sources for speaker in entries[source]['speakers']
+		]
+		if not fragments:
+			raise ValueError("No syllable tiers to build {} from".format(outfile))
+		table = {
+			name: np.concatenate([x[name] for x in fragments])
+			for name in fragments[0]
+		}
+		syllable_features.write_csv(table, outfile)
+		record_output(manifest, outfile)
+	return rebuilt
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+		description='Rebuild the syllabified TextGrids and syllable table, '
+					'redoing only what has changed'
+	)
+	parser.add_argument(
+		'--textgrids', nargs='*', default=['data/textgrids_to_syllabify'],
+		help='TextGrid files, directories or glob patterns to syllabify'
+	)
+	parser.add_argument('--outdir', default=OUTPUT_DIR)
+	parser.add_argument(
+		'--sources', nargs='*', default=None,
+		help='Syllabified TextGrids to build the syllable table from (default: '
+			 'the ones built from --textgrids)'
+	)
+	parser.add_argument('--table', default=TABLE_PATH)
+	parser.add_argument(
+		'-j', '--jobs', type=int, default=None,
+		help='Number of worker processes (default: number of cores)'
+	)
+	parser.add_argument(
+		'--force', action='store_true',
+		help='Rebuild everything, replacing outputs that were adopted or edited'
+	)
+	args = parser.parse_args()
+
+	start = time.time()
+	manifest = load_manifest()
+	versions = code_versions()
+
+	reports = build_textgrids(
+		manifest, versions, args.textgrids, args.outdir, args.jobs, args.force
+	)
+	save_manifest(manifest)
+	for report in reports:
+		if 'error' in report:
+			print("FAILED {}:\n{}".format(report['file'], report['error']))
+		else:
+			print("{} -> {} ({} problems)".format(
+				report['file'], report['output'], report['problems']
+			))
+
+	# Defaulting to the outputs of the step above means that editing an
+	# input TextGrid carries through to the table: its output changes, and
+	# build_table notices from the output's hash
+	sources = args.sources
+	if sources is None:
+		sources = syllabified_outputs(args.textgrids, args.outdir)
+	rebuilt = build_table(manifest, versions, sources, args.table, args.force)
+	save_manifest(manifest)
+
+	print("Rebuilt {} TextGrids and {} speakers' syllables in {:.1f}s".format(
+		len(reports), rebuilt, time.time() - start
+	))
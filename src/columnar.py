@@ -0,0 +1,229 @@
+import argparse
+import csv
+import json
+import numpy as np
+import os
+import time
+
+try:
+	import pyarrow
+	import pyarrow.parquet
+except ImportError:
+	pyarrow = None
+
+# Typed columnar storage for the syllable tables, as an alternative to CSV.
+#
+# A table is saved as a directory with one .npy file per column and a
+# schema.json describing them, so loading it is a memory map per column
+# rather than parsing text. Booleans are stored as bool, numbers as
+# int32/int64 or float32/float64, and everything else as a categorical:
+# an integer code per row (-1 for missing) plus the list of categories in
+# the schema. If pyarrow is installed the same table can also be written
+# as Parquet, which R can read with arrow::read_parquet.
+
+SCHEMA_FILE = 'schema.json'
+
+# Strings that mean a value is missing, as in process_youtube_data.R
+NA_VALUES = ('', 'NA', '--undefined--')
+
+BOOL_STRINGS = {'TRUE': True, 'FALSE': False, 'True': True, 'False': False}
+
+def code_dtype(n):
+	# Smallest signed integer type that can hold codes 0..n-1 and -1
+	for dtype in (np.int8, np.int16, np.int32):
+		if n <= np.iinfo(dtype).max:
+			return dtype
+	return np.int64
+
+def encode_column(values, float_dtype=np.float64):
+	"""
+	Converts a column (a NumPy array or a list of values) to the array
+	that gets saved and its schema entry
+	"""
+	values = np.asarray(values)
+	if values.dtype == bool:
+		return values, {'type': 'bool'}
+	if np.issubdtype(values.dtype, np.integer):
+		if len(values) == 0 or (values.min() >= np.iinfo(np.int32).min
+								 and values.max() <= np.iinfo(np.int32).max):
+			return values.astype(np.int32), {'type': 'int32'}
+		return values.astype(np.int64), {'type': 'int64'}
+	if np.issubdtype(values.dtype, np.floating):
+		values = values.astype(float_dtype)
+		return values, {'type': values.dtype.name}
+
+	# Anything else is stored as a categorical
+	missing = np.array([x is None for x in values], dtype=bool)
+	categories = sorted(set(str(x) for x in values[~missing]))
+	lookup = {x: i for i, x in enumerate(categories)}
+	codes = np.array(
+		[-1 if m else lookup[str(x)] for x, m in zip(values, missing)],
+		dtype=code_dtype(len(categories))
+	)
+	return codes, {'type': 'category', 'categories': categories}
+
+def write_columns(table, outdir, float_dtype=np.float64):
+	"""
+	Writes table, a dictionary from column names to arrays or lists (like
+	the ones syllable_features.build_table returns), to outdir
+	"""
+	os.makedirs(outdir, exist_ok=True)
+	schema = {'columns': []}
+	for i, (name, values) in enumerate(table.items()):
+		array, spec = encode_column(values, float_dtype)
+		spec['name'] = name
+		spec['file'] = '{:03d}.npy'.format(i)
+		np.save(os.path.join(outdir, spec['file']), array)
+		schema['columns'].append(spec)
+	schema['rows'] = len(array) if table else 0
+
+	with open(os.path.join(outdir, SCHEMA_FILE), 'w', encoding='utf-8') as f:
+		json.dump(schema, f, ensure_ascii=False, indent=1)
+
+class ColumnTable():
+	"""
+	A table written by write_columns. Columns are memory-mapped when the
+	table is opened and only read from disk when used. table[name] returns
+	a column as an array; for categorical columns this decodes the codes
+	into strings (None where missing), and codes(name) and
+	categories(name) give the undecoded form.
+	"""
+	def __init__(self, path, mmap=True):
+		with open(os.path.join(path, SCHEMA_FILE), encoding='utf-8') as f:
+			schema = json.load(f)
+		self.rows = schema['rows']
+		self.schema = {spec['name']: spec for spec in schema['columns']}
+		self.arrays = {
+			spec['name']: np.load(
+				os.path.join(path, spec['file']), mmap_mode='r' if mmap else None
+			)
+			for spec in schema['columns']
+		}
+
+	def columns(self):
+		return list(self.schema)
+
+	def codes(self, name):
+		return self.arrays[name]
+
+	def categories(self, name):
+		return self.schema[name]['categories']
+
+	def __getitem__(self, name):
+		if self.schema[name]['type'] != 'category':
+			return self.arrays[name]
+		# The extra None at the end is what code -1 picks out
+		categories = np.array(self.categories(name) + [None], dtype=object)
+		return categories[self.arrays[name]]
+
+	def __len__(self):
+		return self.rows
+
+	def to_pandas(self):
+		import pandas as pd
+		data = {}
+		for name, spec in self.schema.items():
+			if spec['type'] == 'category':
+				data[name] = pd.Categorical.from_codes(
+					self.arrays[name], categories=spec['categories']
+				)
+			else:
+				data[name] = self.arrays[name]
+		return pd.DataFrame(data)
+
+def read_columns(path, mmap=True):
+	return ColumnTable(path, mmap)
+
+def parse_column(values, na_values=NA_VALUES):
+	"""
+	Works out the type of a column of CSV strings: bool if every value is
+	TRUE or FALSE, integer or float if they all parse as numbers (missing
+	values make integers floats, with NaN), and strings otherwise
+	"""
+	present = [x for x in values if x not in na_values]
+	if len(present) == len(values) and present and all(x in BOOL_STRINGS for x in present):
+		return np.array([BOOL_STRINGS[x] for x in values], dtype=bool)
+	try:
+		if len(present) == len(values):
+			return np.array([int(x) for x in values], dtype=np.int64)
+	except ValueError:
+		pass
+	try:
+		return np.array(
+			[np.nan if x in na_values else float(x) for x in values], dtype=np.float64
+		)
+	except ValueError:
+		return np.array([None if x in na_values else x for x in values], dtype=object)
+
+def read_csv_table(infile, na_values=NA_VALUES):
+	with open(infile, newline='', encoding='utf-8') as f:
+		reader = csv.reader(f)
+		header = next(reader)
+		rows = list(reader)
+	return {
+		name: parse_column([row[i] for row in rows], na_values)
+		for i, name in enumerate(header)
+	}
+
+def write_parquet(table, outfile, float_dtype=np.float64):
+	# Same encoding as write_columns, with categoricals as Arrow dictionaries
+	if pyarrow is None:
+		raise ImportError('Writing Parquet needs pyarrow')
+	arrays = {}
+	for name, values in table.items():
+		array, spec = encode_column(values, float_dtype)
+		if spec['type'] == 'category':
+			arrays[name] = pyarrow.DictionaryArray.from_arrays(
+				pyarrow.array(array, mask=array < 0), spec['categories']
+			)
+		else:
+			arrays[name] = pyarrow.array(array)
+	pyarrow.parquet.write_table(pyarrow.table(arrays), outfile)
+
+def directory_size(path):
+	return sum(
+		os.path.getsize(os.path.join(path, x)) for x in os.listdir(path)
+	)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+		description='Convert a syllable table from CSV to typed columnar files'
+	)
+	parser.add_argument('infile', nargs='?', default='data/full_syllable_data.csv')
+	parser.add_argument(
+		'outdir', nargs='?', default=None,
+		help='Output directory (default: the input file with .columns instead of .csv)'
+	)
+	parser.add_argument(
+		'--float32', action='store_true',
+		help='Store floating point columns as float32 rather than float64'
+	)
+	parser.add_argument(
+		'--parquet', default=None,
+		help='Also write a Parquet file here (needs pyarrow)'
+	)
+	args = parser.parse_args()
+
+	outdir = args.outdir or os.path.splitext(args.infile)[0] + '.columns'
+	float_dtype = np.float32 if args.float32 else np.float64
+
+	start = time.perf_counter()
+	table = read_csv_table(args.infile)
+	parse_seconds = time.perf_counter() - start
+	write_columns(table, outdir, float_dtype)
+	if args.parquet:
+		write_parquet(table, args.parquet, float_dtype)
+
+	start = time.perf_counter()
+	columns = read_columns(outdir)
+	for name in columns.columns():
+		columns.codes(name).sum()
+	load_seconds = time.perf_counter() - start
+
+	print("{}: {} rows, {} columns".format(args.infile, len(columns), len(table)))
+	print("  csv      {:8.1f} KB  parsed in {:.4f}s".format(
+		os.path.getsize(args.infile) / 1024, parse_seconds
+	))
+	print("  columnar {:8.1f} KB  loaded in {:.4f}s".format(
+		directory_size(outdir) / 1024, load_seconds
+	))
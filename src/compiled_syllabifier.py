@@ -0,0 +1,236 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+import automaton_ops
+import syllabifier
+from syllabifier import Syllabifier, SetOfStringsSemiring
+
+# get_syllabifier() rebuilds its delta list from list comprehensions every
+# time a process starts. This module compiles the syllabifier once into a
+# binary file of integer-coded arrays, which later processes memory-map
+# instead of rebuilding anything. Because the file is mapped read-only,
+# every process that loads it shares the same pages.
+#
+# The file is laid out as:
+#   - the magic bytes MAGIC
+#   - a little-endian uint32 giving the length of the JSON header
+#   - the JSON header: fingerprint, state names, symbols, output strings,
+#     start/end weights, and the position of each array
+#   - padding up to a multiple of 4 bytes
+#   - int32 arrays: two CSR (compressed sparse row) transition tables, one
+#     indexed by (source state, symbol) and one by (target state, symbol),
+#     each with one row per output string of each transition
+
+ARTIFACT_PATH = 'data/syllabifier.bin'
+MAGIC = b'SYLB'
+FORMAT_VERSION = 1
+
+def _csr(states, symbols, output_ids, get_arcs):
+    # Flattens get_arcs(q, x) for every state and symbol into CSR arrays.
+    # offsets[q * len(symbols) + x] is where the rows for (q, x) start.
+    state_ids = {q: i for (i, q) in enumerate(states)}
+    offsets = array('i', [0])
+    others = array('i')
+    outs = array('i')
+    for q in states:
+        for x in symbols:
+            for (p, q1) in get_arcs(q, x):
+                for s in p:
+                    others.append(state_ids[q1])
+                    outs.append(output_ids[s])
+            offsets.append(len(others))
+    return offsets, others, outs
+
+def compile_syllabifier(automaton, path=ARTIFACT_PATH):
+    # Writes automaton (a Syllabifier) to path in the format described above.
+    # States that aren't on any successful path are left out, which doesn't
+    # change any parse, so the file keeps the fingerprint of the automaton
+    # as it was given.
+    fingerprint = automaton.fingerprint()
+    automaton = automaton_ops.trim(automaton)
+    states = list(automaton.all_states())
+    symbols = []
+    for (_, x, _, _) in automaton.deltas:
+        if x not in symbols:
+            symbols.append(x)
+    outputs = []
+    for p in ([v for (_, v) in automaton.starts] +
+              [v for (_, v) in automaton.ends] +
+              [p for (_, _, p, _) in automaton.deltas]):
+        for s in p:
+            if s not in outputs:
+                outputs.append(s)
+    output_ids = {s: i for (i, s) in enumerate(outputs)}
+
+    arrays = {}
+    for (direction, get_arcs) in [('out', automaton.arcs), 
+                                  ('in', automaton.arcs_in)]:
+        offsets, others, outs = _csr(states, symbols, output_ids, get_arcs)
+        arrays[direction + '_offsets'] = offsets
+        arrays[direction + '_states'] = others
+        arrays[direction + '_outputs'] = outs
+
+    layout = {}
+    position = 0
+    for (name, values) in arrays.items():
+        layout[name] = [position, len(values)]
+        position += len(values) * 4
+
+    header = json.dumps({
+        'version': FORMAT_VERSION,
+        'fingerprint': fingerprint,
+        'states': states,
+        'symbols': symbols,
+        'outputs': outputs,
+        'init': [[i, [output_ids[s] for s in automaton.init(q)]]
+                 for (i, q) in enumerate(states)],
+        'fin': [[i, [output_ids[s] for s in automaton.fin(q)]]
+                for (i, q) in enumerate(states)],
+        'arrays': layout
+    }, ensure_ascii=False).encode('utf-8')
+
+    prefix = MAGIC + struct.pack('<I', len(header)) + header
+    prefix += b'\0' * (-len(prefix) % 4)
+
+    # Other processes may have the old file mapped, and truncating it under
+    # them would crash them (SIGBUS), so the new file is written alongside
+    # and renamed over the old one. Processes that have the old one mapped
+    # keep reading it until they close it.
+    temp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(prefix)
+            for values in arrays.values():
+                if sys.byteorder != 'little':
+                    values.byteswap()
+                f.write(values.tobytes())
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+class CompiledSyllabifier(Syllabifier):
+    # A Syllabifier whose transition tables are read straight out of a
+    # memory-mapped file written by compile_syllabifier. Transitions are
+    # decoded the first time they're used and then kept in the same arc
+    # dictionaries GenericAutomaton uses, so everything else (charts,
+    # first_parse, k_best, ...) works unchanged.
+
+    def __init__(self, path=ARTIFACT_PATH):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:4] != MAGIC:
+            raise Exception("{} is not a compiled syllabifier".format(path))
+        (header_len,) = struct.unpack('<I', self._mmap[4:8])
+        header = json.loads(self._mmap[8:8 + header_len].decode('utf-8'))
+        if header['version'] != FORMAT_VERSION:
+            raise Exception("{} was compiled by a different version".format(path))
+        if sys.byteorder != 'little':
+            raise Exception("Compiled syllabifiers require a little-endian machine")
+
+        data_start = 8 + header_len + (-(8 + header_len) % 4)
+        view = memoryview(self._mmap)
+        self._tables = {}
+        for (name, (position, length)) in header['arrays'].items():
+            start = data_start + position
+            self._tables[name] = view[start:start + length * 4].cast('i')
+
+        self.sr = SetOfStringsSemiring()
+        self._fingerprint = header['fingerprint']
+        self._states = header['states']
+        self._state_ids = {q: i for (i, q) in enumerate(self._states)}
+        self._symbol_ids = {x: i for (i, x) in enumerate(header['symbols'])}
+        self._outputs = header['outputs']
+        self._init = {self._states[i]: [self._outputs[o] for o in outs]
+                      for (i, outs) in header['init']}
+        self._fin = {self._states[i]: [self._outputs[o] for o in outs]
+                     for (i, outs) in header['fin']}
+        self._arcs = {}
+        self._arcs_in = {}
+
+        # The definition as GenericAutomaton keeps it, for the methods that
+        # work from it (map_weights, automaton_ops, ...). deltas is decoded
+        # from the tables only when it's asked for.
+        self.states = self._states
+        self.starts = list(self._init.items())
+        self.ends = list(self._fin.items())
+
+    @property
+    def deltas(self):
+        return [(q, x, p, q1) for q in self._states for x in self._symbol_ids
+                for (p, q1) in self.arcs(q, x)]
+
+    def _read(self, direction, q, x):
+        # Decodes the rows for (q, x) from one of the CSR tables, grouping
+        # consecutive rows with the same state back into one weight
+        if q not in self._state_ids or x not in self._symbol_ids:
+            return []
+        offsets = self._tables[direction + '_offsets']
+        others = self._tables[direction + '_states']
+        outputs = self._tables[direction + '_outputs']
+        row = self._state_ids[q] * len(self._symbol_ids) + self._symbol_ids[x]
+
+        result = []
+        for i in range(offsets[row], offsets[row + 1]):
+            other = self._states[others[i]]
+            if not result or result[-1][1] != other:
+                result.append(([], other))
+            result[-1][0].append(self._outputs[outputs[i]])
+        return result
+
+    def arcs(self, q, x):
+        if (q, x) not in self._arcs:
+            self._arcs[(q, x)] = self._read('out', q, x)
+        return self._arcs[(q, x)]
+
+    def arcs_in(self, q, x):
+        if (q, x) not in self._arcs_in:
+            self._arcs_in[(q, x)] = self._read('in', q, x)
+        return self._arcs_in[(q, x)]
+
+    def tr(self, q1, x, q2):
+        for (p, q) in self.arcs(q1, x):
+            if q == q2:
+                return p
+        return self.sr.gfalse
+
+    def fingerprint(self):
+        return self._fingerprint
+
+def artifact_version(path):
+    # The format version a compiled syllabifier was written with, or None
+    # if path isn't one
+    with open(path, 'rb') as f:
+        if f.read(4) != MAGIC:
+            return None
+        (header_len,) = struct.unpack('<I', f.read(4))
+        try:
+            return json.loads(f.read(header_len).decode('utf-8')).get('version')
+        except ValueError:
+            return None
+
+def ensure_compiled(path=ARTIFACT_PATH):
+    # (Re)builds the compiled syllabifier at path if it doesn't exist yet,
+    # is older than the code that defines or compiles the syllabifier, or
+    # was written in another format version. Scripts that start a pool call
+    # this first, so the workers don't all rebuild it.
+    sources = [__file__, syllabifier.__file__, automaton_ops.__file__,
+               sys.modules['Semiring'].__file__]
+    if (not os.path.exists(path) or
+            os.path.getmtime(path) < max(os.path.getmtime(s) for s in sources) or
+            artifact_version(path) != FORMAT_VERSION):
+        compile_syllabifier(syllabifier.get_syllabifier(), path)
+
+def load_syllabifier(path=ARTIFACT_PATH):
+    # Memory-maps the compiled syllabifier at path, building it first if
+    # necessary
+    ensure_compiled(path)
+    return CompiledSyllabifier(path)
+
+if __name__ == "__main__":
+    compile_syllabifier(syllabifier.get_syllabifier())
+    print("Wrote {} ({} bytes)".format(ARTIFACT_PATH, os.path.getsize(ARTIFACT_PATH)))
@@ -0,0 +1,122 @@
+import argparse
+import csv
+import numpy as np
+import process_textgrid
+import syllable_features
+import textgrid_io
+
+# Aligns the gesture apexes annotated in data/uyghur_gestures_annotated.csv
+# (t1_ax to t2_ax) with the syllables they overlap.
+#
+# Within a speaker, syllables don't overlap, so sorted by start time their
+# end times are sorted too. The syllables overlapping a span are then a
+# contiguous run found with two binary searches, and all gestures are
+# aligned at once with np.searchsorted: O((n + m) log n) for n syllables
+# and m gestures.
+
+GESTURE_PATH = 'data/uyghur_gestures_annotated.csv'
+
+# Speaker names in the gesture annotations, and their tier prefixes
+SUBJECTS = {
+	'Gulnisa': 'A',
+	'Mustafa': 'B',
+	'Elise': 'C'
+}
+
+def read_gestures(infile=GESTURE_PATH):
+	# Returns the speaker prefix, apex start and apex end of each gesture
+	with open(infile, newline='', encoding='utf-8-sig') as f:
+		rows = list(csv.DictReader(f))
+	return {
+		'subject': np.array([SUBJECTS.get(row['Subject'], row['Subject']) for row in rows]),
+		'start_time': np.array([float(row['t1_ax']) for row in rows]),
+		'end_time': np.array([float(row['t2_ax']) for row in rows])
+	}
+
+def overlapping(starts, ends, span_starts, span_ends):
+	"""
+	For intervals sorted by start time that don't overlap each other,
+	returns (interval, span, overlap) arrays with one entry for every
+	interval that each span overlaps, and how long they overlap for. A
+	span of length zero overlaps the interval it falls in.
+	"""
+	lo = np.searchsorted(ends, span_starts, side='right')
+	hi = np.searchsorted(starts, span_ends, side='right')
+	counts = np.maximum(hi - lo, 0)
+	span = np.repeat(np.arange(len(span_starts)), counts)
+	interval = np.repeat(lo, counts) + (
+		np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+	)
+	overlap = (np.minimum(ends[interval], span_ends[span])
+			   - np.maximum(starts[interval], span_starts[span]))
+	keep = (overlap > 0) | (span_starts[span] == span_ends[span])
+	return interval[keep], span[keep], overlap[keep]
+
+def align_gestures(table, gestures):
+	"""
+	Aligns gestures (from read_gestures) with the syllables of table (as
+	built by syllable_features.build_table). Returns, for each syllable,
+	the number of gesture apexes overlapping it and the total overlap in
+	ms, and the indices of the gestures that overlap no syllable.
+	"""
+	n = len(table['subject'])
+	counts = np.zeros(n, dtype=int)
+	overlap_ms = np.zeros(n)
+	matched = np.zeros(len(gestures['subject']), dtype=bool)
+
+	for speaker in np.unique(gestures['subject']):
+		rows = np.flatnonzero(table['subject'] == speaker)
+		rows = rows[np.argsort(table['start_time'][rows], kind='stable')]
+		spans = np.flatnonzero(gestures['subject'] == speaker)
+		interval, span, overlap = overlapping(
+			table['start_time'][rows], table['end_time'][rows],
+			gestures['start_time'][spans], gestures['end_time'][spans]
+		)
+		np.add.at(counts, rows[interval], 1)
+		np.add.at(overlap_ms, rows[interval], 1000 * overlap)
+		matched[spans[span]] = True
+
+	return counts, overlap_ms, np.flatnonzero(~matched)
+
+def add_gestures(table, gestures):
+	# Fills in table's gesture column (1 if any apex overlaps the
+	# syllable), and adds a gesture_overlap_ms column after it. Returns the
+	# indices of the gestures that overlap no syllable.
+	counts, overlap_ms, unmatched = align_gestures(table, gestures)
+	table['gesture'] = (counts > 0).astype(int)
+	columns = list(table)
+	position = columns.index('gesture') + 1
+	new_table = {name: table[name] for name in columns[:position]}
+	new_table['gesture_overlap_ms'] = overlap_ms
+	for name in columns[position:]:
+		new_table[name] = table[name]
+	table.clear()
+	table.update(new_table)
+	return unmatched
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+		description='Align gesture apexes with the syllables they overlap'
+	)
+	parser.add_argument('textgrid', nargs='?', default=process_textgrid.textgrid_file)
+	parser.add_argument('--gestures', default=GESTURE_PATH)
+	parser.add_argument(
+		'--outfile', default=None,
+		help='Write the syllable table with the gesture columns filled in here'
+	)
+	args = parser.parse_args()
+
+	with textgrid_io.TextGridReader(args.textgrid) as reader:
+		table = syllable_features.build_table(process_textgrid.textgrid_columns(reader))
+	gestures = read_gestures(args.gestures)
+	unmatched = add_gestures(table, gestures)
+
+	for i in unmatched:
+		print("No syllable for the {} gesture at {}-{}".format(
+			gestures['subject'][i], gestures['start_time'][i], gestures['end_time'][i]
+		))
+	print("{} gestures, {} syllables with a gesture, {} gestures unmatched".format(
+		len(gestures['subject']), table['gesture'].sum(), len(unmatched)
+	))
+	if args.outfile:
+		syllable_features.write_csv(table, args.outfile)
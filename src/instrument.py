@@ -0,0 +1,199 @@
+import functools
+import json
+import os
+import time
+from collections import defaultdict
+
+# Counters and timers for finding out where a run spends its time.
+#
+# Instrumentation is off unless enable() is called, which scripts do when
+# they're given --profile or the UYGHUR_PROFILE environment variable is set.
+# enable() wraps the functions listed in PROBES (transliteration, automaton
+# evaluation, the syllable cache, tier alignment and TextGrid I/O) in
+# timers; while it's off nothing is wrapped, so there is no overhead at all.
+#
+# Timers nest: each one records its own time (excluding the timers started
+# inside it) under the path of timers enclosing it, as in a profiler's call
+# stack. write_report saves the totals as JSON, and the stacks in the
+# "folded" format read by flamegraph.pl and speedscope.
+
+ENV_VAR = 'UYGHUR_PROFILE'
+
+enabled = False
+
+# name -> number
+counters = defaultdict(int)
+# name -> [calls, seconds]
+timers = defaultdict(lambda: [0, 0.0])
+# 'outer;inner;...' -> seconds spent in the innermost timer itself
+stacks = defaultdict(float)
+# The running timers: [name, start time, seconds spent in inner timers]
+running = []
+
+def count(name, n=1):
+	if enabled:
+		counters[name] += n
+
+class timer():
+	"""
+	Context manager timing the code inside it under name
+	"""
+	def __init__(self, name):
+		self.name = name
+
+	def __enter__(self):
+		if enabled:
+			running.append([self.name, time.perf_counter(), 0.0])
+		return self
+
+	def __exit__(self, *args):
+		if not enabled or not running:
+			return
+		elapsed = time.perf_counter() - running[-1][1]
+		path = ';'.join(name for (name, _, _) in running)
+		inner = running.pop()[2]
+		timers[self.name][0] += 1
+		timers[self.name][1] += elapsed
+		stacks[path] += elapsed - inner
+		if running:
+			running[-1][2] += elapsed
+
+def reset():
+	counters.clear()
+	timers.clear()
+	stacks.clear()
+	del running[:]
+
+# Wrappers for the probed functions. Each takes the original function and
+# returns its replacement.
+
+def timed(name, size=None):
+	"""
+	Times every call under name. If size is given, size(result, *args) is
+	added to the counter name.size after each call.
+	"""
+	def wrap(function):
+		@functools.wraps(function)
+		def wrapper(*args, **kwargs):
+			count(name + '.calls')
+			with timer(name):
+				result = function(*args, **kwargs)
+			if size is not None:
+				count(name + '.size', size(result, *args))
+			return result
+		return wrapper
+	return wrap
+
+def convert_word_probe(function):
+	import ara_to_lat
+
+	@functools.wraps(function)
+	def wrapper(transducer, word):
+		hits = ara_to_lat.cached_convert_word.cache_info().hits
+		with timer('convert_word'):
+			result = function(transducer, word)
+		count('convert_word.calls')
+		count('convert_word.cache_hits', ara_to_lat.cached_convert_word.cache_info().hits - hits)
+		return result
+	return wrapper
+
+def cached_parse_probe(function):
+	# Sorts the lookups of a syllable_cache.CachedSyllabifier into hits in
+	# memory, hits in the database and misses
+	@functools.wraps(function)
+	def wrapper(self, word):
+		memory_hits = self.lookup.cache_info().hits
+		db_hits = self.hits
+		with timer('cached_first_parse'):
+			result = function(self, word)
+		count('syllable_cache.calls')
+		count('syllable_cache.memory_hits', self.lookup.cache_info().hits - memory_hits)
+		count('syllable_cache.db_hits', self.hits - db_hits)
+		return result
+	return wrapper
+
+def chart_cells(chart, *args):
+	return sum(len(row) for row in chart)
+
+def first_length(result, items, *args):
+	return len(items)
+
+# (module, attribute, wrapper): attribute is a function of the module, or
+# Class.method. Only modules that are imported rather than run as scripts
+# can be probed this way; scripts time their own steps with timer.
+PROBES = [
+	('ara_to_lat', 'convert_word', convert_word_probe),
+	('ara_to_lat', 'hfst_convert_word', timed('hfst_lookup')),
+	('ara_to_lat', 'transliterate', timed('transliterate')),
+	('Semiring', 'GenericAutomaton.backward_chart', timed('backward_chart', chart_cells)),
+	('Semiring', 'GenericAutomaton.forward_chart', timed('forward_chart', chart_cells)),
+	('syllabifier', 'Syllabifier.live_chart', timed('live_chart', chart_cells)),
+	('syllabifier', 'Syllabifier.first_parse', timed('first_parse')),
+	('syllable_cache', 'CachedSyllabifier.first_parse', cached_parse_probe),
+	('tier_alignment', 'intervals_within', timed('intervals_within', first_length)),
+	('tier_alignment', 'containing_intervals', timed('containing_intervals', first_length)),
+	('textgrid_io', 'read_textgrid', timed('read_textgrid')),
+	('textgrid_io', 'write_textgrid', timed('write_textgrid')),
+	('syllable_features', 'build_table', timed('build_table'))
+]
+
+# (owner, attribute, original) for everything enable() replaced
+patched = []
+
+def enable():
+	# Wraps the functions in PROBES and starts recording
+	global enabled
+	if enabled:
+		return
+	for module_name, attribute, probe in PROBES:
+		owner = __import__(module_name)
+		*classes, name = attribute.split('.')
+		for class_name in classes:
+			owner = getattr(owner, class_name)
+		original = owner.__dict__[name]
+		patched.append((owner, name, original))
+		setattr(owner, name, probe(original))
+	enabled = True
+
+def disable():
+	# Puts the original functions back
+	global enabled
+	for owner, name, original in reversed(patched):
+		setattr(owner, name, original)
+	del patched[:]
+	enabled = False
+	reset()
+
+def enable_from_env():
+	if os.environ.get(ENV_VAR):
+		enable()
+
+def report(**info):
+	# The counters and timers so far, plus anything in info
+	result = dict(info)
+	result['timers'] = {
+		name: {'calls': calls, 'seconds': seconds}
+		for name, (calls, seconds) in sorted(timers.items(), key=lambda x: -x[1][1])
+	}
+	result['counters'] = dict(sorted(counters.items()))
+	result['stacks'] = dict(stacks)
+	return result
+
+def folded(stacks):
+	# Stacks in the folded format, with times in microseconds
+	return ''.join(
+		'{} {}\n'.format(path, round(seconds * 1e6))
+		for path, seconds in sorted(stacks.items())
+	)
+
+def write_report(path, **info):
+	"""
+	Writes report(**info) to path (.json) and the stacks to the same path
+	with the extension .folded. Returns the path of the JSON report.
+	"""
+	result = report(**info)
+	with open(path, 'w', encoding='utf-8') as f:
+		json.dump(result, f, ensure_ascii=False, indent=1)
+	with open(os.path.splitext(path)[0] + '.folded', 'w', encoding='utf-8') as f:
+		f.write(folded(result['stacks']))
+	return path
@@ -0,0 +1,123 @@
+import numpy as np
+import time
+from Semiring import BoolSemiring, DoubleSemiring, gfsa2
+
+# For numeric semirings, the value of an automaton on a string is just a
+# product of matrices: a row vector of initial weights, times one transition
+# matrix per symbol, times a column vector of final weights. MatrixAutomaton
+# compiles a GenericAutomaton into exactly those arrays so a whole batch of
+# strings can be scored with a handful of NumPy operations.
+
+# Code used to pad shorter strings in a batch. Its matrix is the identity, so
+# padding doesn't change the value of a string.
+PAD = 0
+
+class MatrixAutomaton():
+    def __init__(self, automaton):
+        if isinstance(automaton.sr, BoolSemiring):
+            self.is_bool = True
+        elif isinstance(automaton.sr, DoubleSemiring):
+            self.is_bool = False
+        else:
+            raise Exception(
+                "MatrixAutomaton only supports Bool and Double semirings"
+            )
+
+        self.states = automaton.all_states()
+        self.state_ids = {q: i for (i, q) in enumerate(self.states)}
+
+        # Symbols are coded from 1, after PAD. Symbols the automaton has
+        # never seen all share the last code, whose matrix is all zeros.
+        self.symbol_ids = {}
+        for (_, x, _, _) in automaton.deltas:
+            self.symbol_ids.setdefault(x, len(self.symbol_ids) + 1)
+        self.unknown = len(self.symbol_ids) + 1
+
+        n = len(self.states)
+        self.init = np.array(
+            [float(automaton.init(q)) for q in self.states]
+        )
+        self.fin = np.array(
+            [float(automaton.fin(q)) for q in self.states]
+        )
+        self.matrices = np.zeros((self.unknown + 1, n, n))
+        self.matrices[PAD] = np.eye(n)
+        for (q1, x, _, q2) in automaton.deltas:
+            self.matrices[
+                self.symbol_ids[x], self.state_ids[q1], self.state_ids[q2]
+            ] = float(automaton.tr(q1, x, q2))
+
+    def encode(self, sequences):
+        # Converts a list of sequences into a (batch, max length) array of
+        # symbol codes, padded at the end with PAD
+        max_len = max((len(seq) for seq in sequences), default=0)
+        codes = np.full((len(sequences), max_len), PAD, dtype=np.int32)
+        for (i, seq) in enumerate(sequences):
+            codes[i, :len(seq)] = [
+                self.symbol_ids.get(x, self.unknown) for x in seq
+            ]
+        return codes
+
+    def score_codes(self, codes):
+        # Scores a padded (batch, length) array of symbol codes, returning
+        # one value per row
+        alpha = np.tile(self.init, (codes.shape[0], 1))
+        for t in range(codes.shape[1]):
+            # Multiplies each row's vector by that row's matrix for the
+            # symbol at position t
+            alpha = np.einsum('bq,bqr->br', alpha, self.matrices[codes[:, t]])
+            if self.is_bool:
+                # Keep boolean values at 0/1 so they can't overflow
+                alpha = (alpha > 0).astype(np.float64)
+
+        values = alpha @ self.fin
+        if self.is_bool:
+            return values > 0
+        return values
+
+    def score(self, sequences, bucket_size=4096):
+        # Scores a list of sequences of any lengths. Sequences are sorted by
+        # length and scored in buckets of bucket_size, so each bucket only
+        # pads up to the longest sequence in it. Values are returned in the
+        # order of the input.
+        dtype = bool if self.is_bool else np.float64
+        values = np.zeros(len(sequences), dtype=dtype)
+        order = sorted(range(len(sequences)), key=lambda i: len(sequences[i]))
+        for start in range(0, len(order), bucket_size):
+            bucket = order[start:start + bucket_size]
+            codes = self.encode([sequences[i] for i in bucket])
+            values[bucket] = self.score_codes(codes)
+        return values
+
+    def val(self, sequence):
+        # Same as GenericAutomaton.val_b for a single sequence
+        return self.score([sequence])[0]
+
+# IPA vowels used in uyghur_cv.dict; everything else is a consonant
+ipa_vowels = {'a', 'ɛ', 'e', 'i', 'o', 'u', 'y', 'ø'}
+
+def read_cv_lexicon(dict_file='uyghur_cv.dict'):
+    # Reads the pronunciation dictionary and returns the CV skeleton of
+    # each entry's pronunciation
+    skeletons = []
+    with open(dict_file, encoding='utf-8') as f:
+        for line in f:
+            if '\t' not in line:
+                continue
+            _, pron = line.rstrip('\n').split('\t', 1)
+            skeletons.append(
+                ''.join('V' if seg in ipa_vowels else 'C' for seg in pron.split())
+            )
+    return skeletons
+
+if __name__ == "__main__":
+    skeletons = read_cv_lexicon()
+    compiled = MatrixAutomaton(gfsa2)
+
+    start = time.time()
+    values = compiled.score(skeletons)
+    elapsed = time.time() - start
+
+    print("Scored {} words in {:.3f}s ({} accepted by gfsa2)".format(
+        len(skeletons), elapsed, int(values.sum())
+    ))
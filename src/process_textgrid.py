@@ -1,146 +1,126 @@
-import csv
-import re
-import tgt
+import argparse
+import columnar
+import instrument
+import os
+import syllable_features
+import textgrid_io
+import tier_alignment
+import tokenizer
 
 textgrid_file = "data/audio/uyghur_conversation.TextGrid"
-textgrid = tgt.read_textgrid(textgrid_file)
-
-ipa_to_uyghur_3 = {
-	'a': 'a',
-	'b': 'b',
-	'd': 'd',
-	'e': 'é',
-	'f': 'f',
-	'h': 'h',
-	'i': 'i',
-	'k': 'k',
-	'l': 'l',
-	'm': 'm',
-	'n': 'n',
-	'o': 'o',
-	'p': 'p',
-	'q': 'q',
-	'r': 'r',
-	's': 's',
-	't': 't',
-	'u': 'u',
-	'w': 'w',
-	'ø': 'ö',
-	'ŋ': 'ng',
-	'ɛ': 'e',
-	'ɡ': 'g',
-	'ʁ': 'gh',
-	'ʃ': 'sh',
-	'ʒ': 'zh',
-	'χ': 'x'
-}
-
-ipa_to_uyghur_2 = {
-	'd͡ʒ': 'j',
-	't͡ʃ': 'ch'
-}
-
-ipa_to_uyghur_1 = {
-	'j': 'y'
-}
-
-ipa_to_uyghur_0 = {
-	'y': 'ü'
-}
 
 def ipa_to_uyg(word):
-	new_word = word
-	for key, val in ipa_to_uyghur_0.items():
-		new_word = re.sub(key, val, new_word)
-
-	for key, val in ipa_to_uyghur_1.items():
-		new_word = re.sub(key, val, new_word)
-
-	for key, val in ipa_to_uyghur_2.items():
-		new_word = re.sub(key, val, new_word)
-
-	for key, val in ipa_to_uyghur_3.items():
-		new_word = re.sub(key, val, new_word)
-
-	return new_word
-
-rows = []
-headers = [
-	'subject',
-	'word',
-	'syllable',
-	'start_time',
-	'end_time',
-	'word_len_syls',
-	'syl_position',
-	'closed_syl',
-	'is_initial',
-	'is_final',
-	'is_penultimate',
-	'is_first_heavy',
-	'is_last_heavy',
-	'preceding_heavy',
-	'following_heavy',
-	'gesture'
-]
-
-def check_heavy(syl):
-	return not syl[-1] in ('a', 'e', 'i', 'o', 'u', 'ü', 'ö', 'é')
-
-for tier_name in textgrid.get_tier_names():
-	if 'syllables' in tier_name:
-		speaker_prefix = tier_name.split('-')[0].strip()
-		tier = textgrid.get_tier_by_name(tier_name)
-		word_tier_name = '{} - words'.format(speaker_prefix)
-		word_tier = textgrid.get_tier_by_name(word_tier_name)
-
-		for interval in tier:
-			# Get properties of syllable
-			start_time = interval.start_time
-			end_time = interval.end_time
-			midpoint = start_time + (end_time - start_time) / 2
-			label = interval.text
-
-			# Get containing word
-			word = word_tier.get_annotations_by_time(midpoint)[-1].text
-			uyg_label = ipa_to_uyg(label)
-			syllables = [re.sub("'", "", x) for x in word.split('.')]
-			word_len = len(syllables)
-			try:
-				syl_position = syllables.index(uyg_label)
-			except:
-				print(word)
-				print(uyg_label)
-				breakpoint()
-			closed_syl = check_heavy(uyg_label)
-			is_initial = syl_position == 0
-			is_final = syl_position == (word_len - 1)
-			is_penultimate = syl_position == (word_len - 2)
-			is_first_heavy = closed_syl and all(not check_heavy(x) for x in syllables[0:syl_position])
-			is_last_heavy = closed_syl and all(not check_heavy(x) for x in syllables[syl_position + 1:])
-			preceding_heavy = any(check_heavy(x) for x in syllables[0:syl_position])
-			following_heavy = any(check_heavy(x) for x in syllables[syl_position+1:])
-
-			rows.append([
-				speaker_prefix,
-				word,
-				label,
-				start_time,
-				end_time,
-				word_len,
-				syl_position,
-				closed_syl,
-				is_initial,
-				is_final,
-				is_penultimate,
-				is_first_heavy,
-				is_last_heavy,
-				preceding_heavy,
-				following_heavy,
-				0
-			])
-
-with open('data/syllable_data.csv', 'w') as f:
-	writer = csv.writer(f)
-	writer.writerow(headers)
-	writer.writerows(rows)
+	return tokenizer.ipa_to_latin.convert(word)
+
+def empty_columns():
+	return {
+		'subject': [],
+		'word': [],
+		'syllable': [],
+		'uyg_syllable': [],
+		'start_time': [],
+		'end_time': [],
+		'word_key': []
+	}
+
+def speaker_tiers(tiers):
+	"""
+	Yields (speaker prefix, syllable intervals, word intervals) for each
+	speaker in a syllabified TextGrid, given its tiers in order: either a
+	tgt.TextGrid or a textgrid_io.TextGridReader. Only the word and
+	syllable tiers are read. TextGrids with a single unprefixed speaker
+	give an empty prefix.
+	"""
+	syllables = {}
+	words = {}
+	for tier in tiers:
+		if 'syllables' in tier.name:
+			found, other = syllables, words
+		elif 'words' in tier.name:
+			found, other = words, syllables
+		else:
+			continue
+
+		if '-' in tier.name:
+			speaker_prefix = tier.name.split('-')[0].strip()
+		else:
+			speaker_prefix = ''
+		found[speaker_prefix] = list(tier)
+		if speaker_prefix in other:
+			yield speaker_prefix, syllables.pop(speaker_prefix), words.pop(speaker_prefix)
+
+def speaker_columns(speaker_prefix, tier, word_tier):
+	"""
+	Collects the columns syllable_features.build_table needs for the
+	syllables of one speaker
+	"""
+	columns = empty_columns()
+
+	# Find the word containing each syllable's midpoint in one pass
+	syl_intervals = list(tier)
+	midpoints = [
+		x.start_time + (x.end_time - x.start_time) / 2 for x in syl_intervals
+	]
+	words = tier_alignment.containing_intervals(midpoints, list(word_tier))
+
+	for interval, word_interval in zip(syl_intervals, words):
+		if word_interval is None:
+			print("No word contains syllable {} at {}".format(
+				interval.text, interval.start_time
+			))
+			continue
+
+		columns['subject'].append(speaker_prefix)
+		columns['word'].append(word_interval.text)
+		columns['syllable'].append(interval.text)
+		columns['uyg_syllable'].append(ipa_to_uyg(interval.text))
+		columns['start_time'].append(interval.start_time)
+		columns['end_time'].append(interval.end_time)
+		columns['word_key'].append((speaker_prefix, word_interval.start_time))
+
+	return columns
+
+def textgrid_columns(textgrid):
+	# Collects the columns for every speaker in textgrid
+	columns = empty_columns()
+	for speaker_prefix, tier, word_tier in speaker_tiers(textgrid):
+		for name, values in speaker_columns(speaker_prefix, tier, word_tier).items():
+			columns[name].extend(values)
+	return columns
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+		description='Extract syllable features from a syllabified TextGrid'
+	)
+	parser.add_argument('textgrid', nargs='?', default=textgrid_file)
+	parser.add_argument('outfile', nargs='?', default='data/syllable_data.csv')
+	parser.add_argument(
+		'--columnar', default=None,
+		help='Also write the table as typed columnar files to this directory'
+	)
+	parser.add_argument(
+		'--profile', action='store_true',
+		help='Write a timing report next to outfile (also turned on by '
+			 'setting {})'.format(instrument.ENV_VAR)
+	)
+	args = parser.parse_args()
+	if args.profile:
+		instrument.enable()
+	else:
+		instrument.enable_from_env()
+
+	with instrument.timer('process_textgrid'):
+		with textgrid_io.TextGridReader(args.textgrid) as reader:
+			with instrument.timer('textgrid_columns'):
+				columns = textgrid_columns(reader)
+			table = syllable_features.build_table(columns)
+		syllable_features.check_table(table)
+		with instrument.timer('write_csv'):
+			syllable_features.write_csv(table, args.outfile)
+		if args.columnar:
+			with instrument.timer('write_columns'):
+				columnar.write_columns(table, args.columnar)
+	if instrument.enabled:
+		instrument.write_report(
+			os.path.splitext(args.outfile)[0] + '.profile.json', file=args.textgrid
+		)
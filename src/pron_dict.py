@@ -0,0 +1,257 @@
+import argparse
+import ara_to_lat
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import unicodedata
+from array import array
+from collections import namedtuple
+
+# An indexed, memory-mapped version of the pronunciation dictionary
+# uyghur_cv.dict (Perso-Arabic words and their IPA pronunciations).
+#
+# The text file is compiled once into a binary file holding every entry's
+# word, pronunciation and Latin spelling (from ara_to_lat.transliterate),
+# plus an index for each of the three: the entry numbers in order of the
+# UTF-8 bytes of that field. Lookups are binary searches over the mapped
+# file, and a prefix search is a binary search followed by a scan, so
+# loading the dictionary costs nothing but the mmap call.
+#
+# The file is laid out like the compiled syllabifier's: MAGIC, a uint32
+# header length, a JSON header giving the position of each section, padding
+# to 4 bytes, and then the sections. For each field there is a blob of
+# concatenated UTF-8 strings, an int32 array of n + 1 offsets into it, and
+# an int32 array with the sorted order of the entries.
+
+DICT_PATH = 'uyghur_cv.dict'
+ARTIFACT_PATH = 'data/pron_dict.bin'
+MAGIC = b'PRON'
+FORMAT_VERSION = 1
+
+# word: Perso-Arabic spelling; pron: IPA segments separated by spaces;
+# ipa: the same without the spaces, which is what lookup_ipa searches;
+# latin: the Latin spelling
+FIELDS = ['word', 'pron', 'ipa', 'latin']
+
+Entry = namedtuple('Entry', ['word', 'pron', 'latin'])
+
+def normalize(text):
+	return unicodedata.normalize('NFC', text.strip())
+
+def iter_dict(dict_file=DICT_PATH):
+	# Yields (word, pronunciation) pairs from uyghur_cv.dict, reading it a
+	# line at a time. Some lines start with a stray quote, and a few
+	# separate the word with a space rather than a tab.
+	with open(dict_file, encoding='utf-8') as f:
+		for line in f:
+			line = line.strip()
+			if not line:
+				continue
+			if '\t' in line:
+				word, pron = line.split('\t', 1)
+			else:
+				word, pron = line.split(None, 1)
+			yield normalize(word.lstrip('"')), ' '.join(pron.split())
+
+def read_dict(dict_file=DICT_PATH):
+	return list(iter_dict(dict_file))
+
+def file_hash(path):
+	with open(path, 'rb') as f:
+		return hashlib.sha1(f.read()).hexdigest()
+
+def compile_dict(dict_file=DICT_PATH, path=ARTIFACT_PATH):
+	# Writes the dictionary at dict_file to path in the format described above
+	entries = read_dict(dict_file)
+	columns = {
+		'word': [word for (word, _) in entries],
+		'pron': [pron for (_, pron) in entries],
+		'ipa': [pron.replace(' ', '') for (_, pron) in entries],
+		'latin': [ara_to_lat.transliterate(word) for (word, _) in entries]
+	}
+
+	sections = {}
+	for field in FIELDS:
+		encoded = [x.encode('utf-8') for x in columns[field]]
+		offsets = array('i', [0])
+		for x in encoded:
+			offsets.append(offsets[-1] + len(x))
+		order = array('i', sorted(range(len(encoded)), key=encoded.__getitem__))
+		if sys.byteorder != 'little':
+			offsets.byteswap()
+			order.byteswap()
+		sections[field + '_offsets'] = offsets.tobytes()
+		sections[field + '_order'] = order.tobytes()
+		sections[field + '_blob'] = b''.join(encoded)
+
+	layout = {}
+	position = 0
+	for (name, data) in sections.items():
+		layout[name] = [position, len(data)]
+		position += len(data) + (-len(data) % 4)
+
+	header = json.dumps({
+		'version': FORMAT_VERSION,
+		'source': file_hash(dict_file),
+		'size': len(entries),
+		'sections': layout
+	}).encode('utf-8')
+	prefix = MAGIC + struct.pack('<I', len(header)) + header
+	prefix += b'\0' * (-len(prefix) % 4)
+
+	# Written alongside and renamed into place, so that processes that have
+	# the old file mapped keep reading it instead of crashing (SIGBUS) when
+	# it's truncated under them
+	temp_path = '{}.{}.tmp'.format(path, os.getpid())
+	try:
+		with open(temp_path, 'wb') as f:
+			f.write(prefix)
+			for data in sections.values():
+				f.write(data + b'\0' * (-len(data) % 4))
+		os.replace(temp_path, path)
+	finally:
+		if os.path.exists(temp_path):
+			os.remove(temp_path)
+
+class PronDict():
+	"""
+	A dictionary compiled by compile_dict, memory-mapped. Lookups return
+	lists of Entry tuples, since some words have more than one
+	pronunciation and many pronunciations have more than one spelling.
+	"""
+	def __init__(self, path=ARTIFACT_PATH):
+		with open(path, 'rb') as f:
+			self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+		if self.mmap[:4] != MAGIC:
+			raise Exception("{} is not a compiled pronunciation dictionary".format(path))
+		(header_len,) = struct.unpack('<I', self.mmap[4:8])
+		self.header = json.loads(self.mmap[8:8 + header_len].decode('utf-8'))
+		if self.header['version'] != FORMAT_VERSION:
+			raise Exception("{} was compiled by a different version".format(path))
+
+		data_start = 8 + header_len + (-(8 + header_len) % 4)
+		view = memoryview(self.mmap)
+		self.sections = {}
+		for (name, (position, length)) in self.header['sections'].items():
+			section = view[data_start + position:data_start + position + length]
+			self.sections[name] = section if name.endswith('_blob') else section.cast('i')
+		self.size = self.header['size']
+
+	def __len__(self):
+		return self.size
+
+	def key(self, field, i):
+		# The UTF-8 bytes of field for entry i
+		offsets = self.sections[field + '_offsets']
+		return self.sections[field + '_blob'][offsets[i]:offsets[i + 1]].tobytes()
+
+	def entry(self, i):
+		return Entry(*[
+			self.key(field, i).decode('utf-8') for field in ('word', 'pron', 'latin')
+		])
+
+	def lower_bound(self, field, key):
+		# Position in field's sorted order of the first entry >= key
+		order = self.sections[field + '_order']
+		lo, hi = 0, self.size
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if self.key(field, order[mid]) < key:
+				lo = mid + 1
+			else:
+				hi = mid
+		return lo
+
+	def search(self, field, key, prefix=False, limit=None):
+		key = normalize(key)
+		if field == 'ipa':
+			key = key.replace(' ', '')
+		key = key.encode('utf-8')
+		order = self.sections[field + '_order']
+
+		result = []
+		i = self.lower_bound(field, key)
+		while i < self.size and (limit is None or len(result) < limit):
+			found = self.key(field, order[i])
+			if found != key and not (prefix and found.startswith(key)):
+				break
+			result.append(self.entry(order[i]))
+			i += 1
+		return result
+
+	def lookup(self, word):
+		# Entries spelled word in Perso-Arabic
+		return self.search('word', word)
+
+	def lookup_latin(self, word):
+		# Entries spelled word in Latin
+		return self.search('latin', word)
+
+	def lookup_ipa(self, pron):
+		# Entries pronounced pron, with or without spaces between segments
+		return self.search('ipa', pron)
+
+	def prefix(self, prefix, field='word', limit=None):
+		# Entries whose field ('word', 'latin' or 'ipa') starts with prefix
+		return self.search(field, prefix, prefix=True, limit=limit)
+
+	def contains_many(self, words, field='word'):
+		# Which of words are in the dictionary, looking each distinct word
+		# up only once
+		found = {word: bool(self.search(field, word, limit=1)) for word in set(words)}
+		return [found[word] for word in words]
+
+	def __contains__(self, word):
+		return bool(self.search('word', word, limit=1))
+
+	def close(self):
+		self.sections = {}
+		self.mmap.close()
+
+def artifact_version(path):
+	# The format version a compiled dictionary was written with, or None if
+	# path isn't one
+	with open(path, 'rb') as f:
+		if f.read(4) != MAGIC:
+			return None
+		(header_len,) = struct.unpack('<I', f.read(4))
+		try:
+			return json.loads(f.read(header_len).decode('utf-8')).get('version')
+		except ValueError:
+			return None
+
+def load_dict(dict_file=DICT_PATH, path=ARTIFACT_PATH):
+	# Memory-maps the compiled dictionary at path. It's (re)built first if
+	# it doesn't exist yet, is older than dict_file, this module or the
+	# transliterator, or was written in another format version.
+	sources = [dict_file, __file__, ara_to_lat.__file__]
+	if (not os.path.exists(path) or
+			os.path.getmtime(path) < max(os.path.getmtime(s) for s in sources) or
+			artifact_version(path) != FORMAT_VERSION):
+		compile_dict(dict_file, path)
+	return PronDict(path)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+		description='Look words up in the compiled pronunciation dictionary'
+	)
+	parser.add_argument('words', nargs='*')
+	parser.add_argument(
+		'--by', choices=['word', 'latin', 'ipa'], default='word',
+		help='What the words are: Perso-Arabic spellings, Latin spellings or IPA'
+	)
+	parser.add_argument('--prefix', action='store_true', help='Search by prefix')
+	parser.add_argument('--limit', type=int, default=20)
+	parser.add_argument('--dict', default=DICT_PATH)
+	args = parser.parse_args()
+
+	pron_dict = load_dict(args.dict)
+	if not args.words:
+		print("{}: {} entries".format(ARTIFACT_PATH, len(pron_dict)))
+	for word in args.words:
+		for entry in pron_dict.search(args.by, word, args.prefix, args.limit):
+			print('\t'.join(entry))
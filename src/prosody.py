@@ -0,0 +1,175 @@
+import argparse
+import columnar
+import csv
+import difflib
+import gestures
+import json
+import numpy as np
+import process_textgrid
+import syllable_features
+import textgrid_io
+
+# Joins the ProsodyPro measurements in data/pitchpro_*.tsv onto the rows of
+# the syllable table, producing full_syllable_data.csv.
+#
+# ProsodyPro writes one row per labelled interval of a speaker's syllable
+# tier, in tier order, with the label and the interval's duration in ms but
+# no times. Rows are matched within each speaker on their duration, which
+# ProsodyPro computes from the same interval times, and the labels are
+# checked as well. In the usual case the two sides line up row for row and
+# the whole check is a handful of array comparisons; if a row is missing on
+# either side, the sequences of durations are aligned to find it, and the
+# rows that can't be matched are reported.
+
+# ProsodyPro output file for each speaker prefix in the TextGrid
+SPEAKERS = {
+	'A': 'gulnisa',
+	'B': 'mustafa',
+	'C': 'elise'
+}
+PITCHPRO_PATH = 'data/pitchpro_{}.tsv'
+
+# Written for missing measurements, as in data/pitchpro_*.tsv and the
+# committed full_syllable_data.csv (process_youtube_data.R reads it as NA)
+MISSING = '--undefined--'
+
+# How far apart (in ms) the durations of matching rows can be
+TOLERANCE_MS = 0.5
+
+def read_pitchpro(infile):
+	"""
+	Reads a ProsodyPro TSV into a dictionary of arrays: rowLabel as
+	strings, and every other column as floats with --undefined-- as NaN
+	"""
+	with open(infile, newline='', encoding='utf-8') as f:
+		reader = csv.reader(f, delimiter='\t')
+		header = next(reader)
+		rows = [row for row in reader if row]
+	table = {'rowLabel': np.array([row[0] for row in rows])}
+	for i, name in enumerate(header[1:], 1):
+		table[name] = columnar.parse_column([row[i] for row in rows]).astype(float)
+	return table
+
+def duration_key(durations):
+	# Durations rounded to the tolerance, for aligning the two sides
+	return [int(x) for x in np.rint(np.asarray(durations) / (2 * TOLERANCE_MS))]
+
+def match_rows(durations, pitch_durations):
+	"""
+	Returns two arrays of indices into durations and pitch_durations giving
+	the pairs of rows that match
+	"""
+	if len(durations) == len(pitch_durations):
+		same = np.abs(durations - pitch_durations) <= TOLERANCE_MS
+		if same.all():
+			index = np.arange(len(durations))
+			return index, index
+
+	matcher = difflib.SequenceMatcher(
+		None, duration_key(durations), duration_key(pitch_durations), autojunk=False
+	)
+	rows = []
+	pitch_rows = []
+	for i, j, n in matcher.get_matching_blocks():
+		rows.extend(range(i, i + n))
+		pitch_rows.extend(range(j, j + n))
+	return np.array(rows, dtype=int), np.array(pitch_rows, dtype=int)
+
+def join_prosody(table, pitch_tables):
+	"""
+	Adds the ProsodyPro columns to table (as returned by
+	syllable_features.build_table). pitch_tables maps speaker prefixes to
+	tables from read_pitchpro. Rows without a match get NaN. Returns the
+	joined table and a list of problems, one per row that couldn't be
+	matched or whose labels disagree.
+	"""
+	n = len(table['subject'])
+	names = [
+		name for name in next(iter(pitch_tables.values())) if name != 'rowLabel'
+	]
+	joined = dict(table)
+	for name in names:
+		joined[name] = np.full(n, np.nan)
+	problems = []
+
+	durations = (table['end_time'] - table['start_time']) * 1000
+	for speaker, pitch in pitch_tables.items():
+		speaker_rows = np.flatnonzero(table['subject'] == speaker)
+		rows, pitch_rows = match_rows(durations[speaker_rows], pitch['duration'])
+		matched = speaker_rows[rows]
+		for name in names:
+			joined[name][matched] = pitch[name][pitch_rows]
+
+		for i in np.setdiff1d(speaker_rows, matched):
+			problems.append({
+				'subject': speaker,
+				'row': int(i),
+				'syllable': table['syllable'][i],
+				'start_time': float(table['start_time'][i]),
+				'problem': 'No ProsodyPro row'
+			})
+		for j in np.setdiff1d(np.arange(len(pitch['duration'])), pitch_rows):
+			problems.append({
+				'subject': speaker,
+				'pitchpro_row': int(j),
+				'syllable': pitch['rowLabel'][j],
+				'problem': 'ProsodyPro row with no syllable: {:.1f} ms'.format(
+					pitch['duration'][j]
+				)
+			})
+		different = np.flatnonzero(table['syllable'][matched] != pitch['rowLabel'][pitch_rows])
+		for k in different:
+			problems.append({
+				'subject': speaker,
+				'row': int(matched[k]),
+				'syllable': table['syllable'][matched[k]],
+				'start_time': float(table['start_time'][matched[k]]),
+				'problem': 'ProsodyPro label is {}'.format(pitch['rowLabel'][pitch_rows[k]])
+			})
+
+	return joined, problems
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+		description='Extract syllable features, and add the ProsodyPro measurements '
+					'and gestures to them'
+	)
+	parser.add_argument('textgrid', nargs='?', default=process_textgrid.textgrid_file)
+	parser.add_argument('outfile', nargs='?', default='data/full_syllable_data.csv')
+	parser.add_argument(
+		'--columnar', default=None,
+		help='Also write the table as typed columnar files to this directory'
+	)
+	parser.add_argument(
+		'--gestures', default=gestures.GESTURE_PATH,
+		help='Gesture annotations to fill in the gesture column from ("" for none)'
+	)
+	parser.add_argument(
+		'--problems', default=None,
+		help='Write the rows that could not be matched to this JSON file'
+	)
+	args = parser.parse_args()
+
+	with textgrid_io.TextGridReader(args.textgrid) as reader:
+		table = syllable_features.build_table(process_textgrid.textgrid_columns(reader))
+	syllable_features.check_table(table)
+
+	pitch_tables = {
+		speaker: read_pitchpro(PITCHPRO_PATH.format(name))
+		for speaker, name in SPEAKERS.items()
+	}
+	joined, problems = join_prosody(table, pitch_tables)
+	if args.gestures:
+		unmatched = gestures.add_gestures(joined, gestures.read_gestures(args.gestures))
+		print("{} gestures overlap no syllable".format(len(unmatched)))
+
+	for problem in problems:
+		print("{}: {} ({})".format(problem['subject'], problem['problem'], problem['syllable']))
+	print("{} rows, {} problems".format(len(joined['subject']), len(problems)))
+	if args.problems:
+		with open(args.problems, 'w', encoding='utf-8') as f:
+			json.dump(problems, f, ensure_ascii=False, indent=1)
+
+	syllable_features.write_csv(joined, args.outfile, missing=MISSING)
+	if args.columnar:
+		columnar.write_columns(joined, args.columnar)
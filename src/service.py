@@ -0,0 +1,174 @@
+import argparse
+import ara_to_lat
+import compiled_syllabifier
+import json
+import os
+import signal
+import socketserver
+import sys
+import syllable_cache
+import syllabify_textgrid
+import textgrid_io
+import time
+import traceback
+
+# A long-running process that keeps the transducer, the syllabifier and
+# their caches loaded, so that checking a few words while correcting an
+# annotation doesn't pay for importing tgt/hfst and loading everything
+# again each time.
+#
+# Requests and responses are JSON objects, one per line, read from stdin and
+# written to stdout, or exchanged over a Unix socket (see service_client.py
+# for a client). A request names an op and gives its arguments:
+#
+#   {"id": 1, "op": "transliterate", "texts": ["...", ...]}
+#   {"id": 2, "op": "syllabify", "words": ["kitab", ...]}
+#   {"id": 3, "op": "syllabify_tier", "words": [
+#       {"text": "...", "phones": [[start, end, label], ...]}, ...]}
+#
+# and the response is {"id": ..., "result": ...} or {"id": ..., "error": ...}.
+# Every op takes a batch and returns a list with one result per item.
+
+SOCKET_PATH = os.environ.get('UYGHUR_SERVICE_SOCKET', '/tmp/uyghur_gesture.sock')
+
+class Service():
+	def __init__(self):
+		self.transducer = ara_to_lat.load_transducer()
+		self.syller = syllable_cache.CachedSyllabifier(
+			compiled_syllabifier.load_syllabifier()
+		)
+		self.started = time.time()
+		self.requests = 0
+
+	def transliterate(self, texts):
+		# Perso-Arabic words or sentences to Latin
+		return [ara_to_lat.convert_sentence(self.transducer, text) for text in texts]
+
+	def syllabify(self, words):
+		# Latin words to syllabified Latin words, or None if they can't be
+		# parsed
+		result = []
+		for word in words:
+			parse = self.syller.first_parse(syllabify_textgrid.convert_ortho(word))
+			if parse is not None:
+				parse = syllabify_textgrid.convert_ortho(parse, reverse = True)
+			result.append(parse)
+		return result
+
+	def syllabify_tier(self, words):
+		"""
+		Does what syllabify_textgrid.py does to each interval of a word tier:
+		each word is a word interval's text and the [start, end, label]
+		phones inside it. Returns the converted text, the syllables as
+		[start, end, label] and the problem (or None) for each word.
+		"""
+		result = []
+		for word in words:
+			phones = [textgrid_io.Interval(*phone) for phone in word['phones']]
+			text, syllables, problem = syllabify_textgrid.syllabify_word(
+				word['text'], phones, self.transducer, self.syller
+			)
+			result.append({
+				'text': text,
+				'syllables': [list(syllable) for syllable in syllables],
+				'problem': problem
+			})
+		return result
+
+	def stats(self):
+		return {
+			'uptime_seconds': time.time() - self.started,
+			'requests': self.requests,
+			'cached_words': ara_to_lat.cached_convert_word.cache_info().currsize,
+			'syllable_cache': self.syller.cache_info()
+		}
+
+	def handle(self, request):
+		# Answers one request; errors are returned rather than raised, so a
+		# bad request doesn't stop the service
+		self.requests += 1
+		response = {'id': request.get('id')}
+		try:
+			op = request['op']
+			if op == 'transliterate':
+				response['result'] = self.transliterate(request['texts'])
+			elif op == 'syllabify':
+				response['result'] = self.syllabify(request['words'])
+			elif op == 'syllabify_tier':
+				response['result'] = self.syllabify_tier(request['words'])
+			elif op == 'stats':
+				response['result'] = self.stats()
+			else:
+				raise Exception("Unknown op {}".format(op))
+		except Exception:
+			response['error'] = traceback.format_exc()
+
+		# New parses are written out even if the op failed part way
+		try:
+			self.syller.flush()
+		except Exception:
+			response.setdefault('error', traceback.format_exc())
+		return response
+
+	def handle_line(self, line):
+		try:
+			request = json.loads(line)
+		except ValueError as e:
+			return {'id': None, 'error': "Bad request: {}".format(e)}
+		if not isinstance(request, dict):
+			return {'id': None, 'error': "Bad request: expected a JSON object"}
+		return self.handle(request)
+
+	def close(self):
+		self.syller.close()
+
+def serve_stdio(service, infile=sys.stdin, outfile=sys.stdout):
+	for line in infile:
+		if line.strip():
+			outfile.write(json.dumps(service.handle_line(line), ensure_ascii=False) + '\n')
+			outfile.flush()
+
+def serve_socket(service, path=SOCKET_PATH):
+	# Serves one connection at a time; each connection can send any number
+	# of requests
+	class Handler(socketserver.StreamRequestHandler):
+		def handle(self):
+			for line in self.rfile:
+				if line.strip():
+					response = service.handle_line(line.decode('utf-8'))
+					self.wfile.write((json.dumps(response, ensure_ascii=False) + '\n').encode('utf-8'))
+					self.wfile.flush()
+
+	if os.path.exists(path):
+		os.remove(path)
+	with socketserver.UnixStreamServer(path, Handler) as server:
+		try:
+			server.serve_forever()
+		finally:
+			os.remove(path)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+		description='Keep the transliterator and syllabifier loaded and answer '
+					'JSON-lines requests'
+	)
+	parser.add_argument(
+		'--socket', nargs='?', const=SOCKET_PATH, default=None,
+		help='Listen on a Unix socket (default {}) instead of stdin/stdout'.format(SOCKET_PATH)
+	)
+	args = parser.parse_args()
+
+	# Shut down cleanly (removing the socket) when killed
+	signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+
+	service = Service()
+	try:
+		if args.socket:
+			print("Listening on {}".format(args.socket), file=sys.stderr)
+			serve_socket(service, args.socket)
+		else:
+			serve_stdio(service)
+	except KeyboardInterrupt:
+		pass
+	finally:
+		service.close()
@@ -0,0 +1,72 @@
+import argparse
+import json
+import os
+import socket
+import sys
+
+# Client for service.py running with --socket. It only imports the standard
+# library, so starting it takes milliseconds:
+#
+#     python src/service_client.py transliterate WORD ...
+#     python src/service_client.py syllabify WORD ...
+#
+# Without words, one word or text per line is read from stdin.
+
+SOCKET_PATH = os.environ.get('UYGHUR_SERVICE_SOCKET', '/tmp/uyghur_gesture.sock')
+
+class Client():
+	def __init__(self, path=SOCKET_PATH):
+		self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.socket.connect(path)
+		self.file = self.socket.makefile('rwb')
+		self.next_id = 0
+
+	def call(self, op, **arguments):
+		# Sends one request and returns its result, raising an exception if
+		# the service reports an error
+		self.next_id += 1
+		request = dict(arguments, op=op, id=self.next_id)
+		self.file.write((json.dumps(request, ensure_ascii=False) + '\n').encode('utf-8'))
+		self.file.flush()
+		response = json.loads(self.file.readline().decode('utf-8'))
+		if 'error' in response:
+			raise Exception(response['error'])
+		return response['result']
+
+	def transliterate(self, texts):
+		return self.call('transliterate', texts=texts)
+
+	def syllabify(self, words):
+		return self.call('syllabify', words=words)
+
+	def syllabify_tier(self, words):
+		return self.call('syllabify_tier', words=words)
+
+	def close(self):
+		self.file.close()
+		self.socket.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Send requests to service.py')
+	parser.add_argument('op', choices=['transliterate', 'syllabify', 'stats'])
+	parser.add_argument('items', nargs='*')
+	parser.add_argument('--socket', default=SOCKET_PATH)
+	args = parser.parse_args()
+
+	with Client(args.socket) as client:
+		if args.op == 'stats':
+			print(json.dumps(client.call('stats'), indent=1))
+		else:
+			items = args.items or [line.strip() for line in sys.stdin if line.strip()]
+			if args.op == 'transliterate':
+				results = client.transliterate(items)
+			else:
+				results = client.syllabify(items)
+			for item, result in zip(items, results):
+				print("{}\t{}".format(item, result))
@@ -1,68 +1,10 @@
 from Semiring import (
-    Semiring, remove_duplicates, BoolSemiring, DoubleSemiring
+    Semiring, GenericAutomaton, BoolSemiring, DoubleSemiring
 )
+from array import array
+from itertools import islice
 from math import inf
 
-# Here's a generic automaton type that takes a semiring
-# and uses it to perform operations on its values
-class GenericAutomaton():
-    def __init__(self, starts, ends, deltas, semiring):
-        self.starts = starts
-        self.ends = ends
-        self.deltas = deltas
-        self.sr = semiring
-
-    def all_states(self):
-        # Returns all states in the FSA
-        return remove_duplicates(
-            [q for (q, _) in self.starts] + 
-            [q for (q, _) in self.ends] + 
-            [q for (q1, _, _, q2) in self.deltas for q in (q1, q2)]
-        )
-
-    def init(self, q):
-        return self.sr.big_gdisj([v for (q1, v) in self.starts if q == q1])
-
-    def fin(self, q):
-        return self.sr.big_gdisj([v for (q1, v) in self.ends if q == q1])
-
-    def tr(self, q1, x, q2):
-        return self.sr.big_gdisj(
-            [p for (q3, y, p, q4) in self.deltas if (q3, y, q4) == (q1, x, q2)]
-        )
-
-    def backward(self, sequence, q):
-        if not sequence:
-            return self.fin(q)
-        first = sequence[0]
-        rest = sequence[1:]
-        return self.sr.big_gdisj(
-            [self.sr.gconj(self.tr(q, first, q1), self.backward(rest, q1)) 
-             for q1 in self.all_states() if self.tr(q, first, q1) != self.sr.gfalse]
-        )
-
-    def val_b(self, sequence):
-        return self.sr.big_gdisj(
-            [self.sr.gconj(self.init(q), self.backward(sequence, q)) 
-             for q in self.all_states() if self.init(q) != self.sr.gfalse]
-        )
-
-    def forward(self, sequence, q):
-        if not sequence:
-            return self.init(q)
-        last = sequence[-1]
-        rest = sequence[:-1]
-        return self.sr.big_gdisj(
-            [self.sr.gconj(self.forward(rest, q1), self.tr(q1, last, q))
-            for q1 in self.all_states() if self.tr(q1, last, q) != self.sr.gfalse]
-        )
-
-    def val_f(self, sequence):
-        return self.sr.big_gdisj(
-            [self.sr.gconj(self.forward(sequence, q), self.fin(q))
-            for q in self.all_states() if self.fin(q) != self.sr.gfalse]
-        )
-
 class SetOfStringsSemiring(Semiring):
     gtrue = ['']
     gfalse = []
@@ -73,6 +15,116 @@ class SetOfStringsSemiring(Semiring):
     def gdisj(self, x, y):
         return x + y
 
+# Symbols that are written but aren't segments (have no phone of their own)
+SILENT = {"'", '-'}
+
+def parse_boundaries(parse):
+    # The syllable boundaries of a syllabified string, counted in segments
+    # as in Syllabifier.boundaries
+    result = array('i')
+    segments = 0
+    for c in parse:
+        if c == '.':
+            result.append(segments)
+        elif c not in SILENT:
+            segments += 1
+    return result
+
+# Marks the last step of a parse, where the final weight of the state
+# reached is appended instead of following a transition
+_FINAL = object()
+
+class Syllabifier(GenericAutomaton):
+    # A GenericAutomaton over SetOfStringsSemiring that can also hand out its
+    # parses lazily. val_b builds every parse of a word before returning; 
+    # parses, first_parse and k_best produce them one at a time, in the same
+    # order val_b lists them (i.e. following the order of the deltas), so
+    # first_parse(word) == val_b(word)[0].
+
+    def live_chart(self, word):
+        # Row i is the set of states from which word[i:] can be completed.
+        # Following only transitions into live states means the search below
+        # never backtracks out of a dead end.
+        n = len(word)
+        live = [None] * (n + 1)
+        live[n] = {q for (q, v) in self._fin.items() if v != self.sr.gfalse}
+        for i in range(n - 1, -1, -1):
+            x = word[i]
+            following = live[i + 1]
+            live[i] = {q for q in self._states 
+                       if any(q1 in following for (_, q1) in self.arcs(q, x))}
+        return live
+
+    def paths(self, word):
+        # Yields each parse as a list of output pieces: the initial weight,
+        # one piece per symbol of word, and the final weight. The search
+        # keeps a stack of choice points rather than recursing, so memory is 
+        # linear in the length of the word.
+        live = self.live_chart(word)
+        n = len(word)
+
+        def choices(i, q):
+            if i == n:
+                return ((s, _FINAL) for s in self.fin(q))
+            return ((s, q1) for (p, q1) in self.arcs(q, word[i])
+                    if q1 in live[i + 1] for s in p)
+
+        stack = [((s, q) for q in self._states if q in live[0] 
+                  for s in self.init(q))]
+        path = []
+        while stack:
+            step = next(stack[-1], None)
+            if step is None:
+                stack.pop()
+                if path:
+                    path.pop()
+                continue
+
+            piece, q = step
+            if q is _FINAL:
+                yield path + [piece]
+                continue
+
+            path.append(piece)
+            stack.append(choices(len(path) - 1, q))
+
+    def parses(self, word):
+        # Yields the syllabified strings for word one at a time
+        for path in self.paths(word):
+            yield ''.join(path)
+
+    def first_parse(self, word):
+        # Returns the first syllabification of word, or None if it 
+        # can't be parsed
+        return next(self.parses(word), None)
+
+    def boundaries(self, word, path):
+        # Turns a path from paths(word) into an array of the positions of 
+        # its syllable boundaries, counted in segments (symbols not in 
+        # SILENT): a boundary k means a syllable starts after the first k 
+        # segments. So a word's phones can be split into syllables by
+        # slicing at the boundaries.
+        result = array('i')
+        segments = 0
+        for x, piece in zip(word, path[1:-1]):
+            if piece.startswith('.'):
+                result.append(segments)
+            if x not in SILENT:
+                segments += 1
+        return result
+
+    def first_parse_boundaries(self, word):
+        # Returns the first syllabification of word together with its
+        # boundaries, or None if it can't be parsed
+        path = next(self.paths(word), None)
+        if path is None:
+            return None
+        return ''.join(path), self.boundaries(word, path)
+
+    def k_best(self, word, k):
+        # Returns (at most) the first k syllabifications of word
+        return list(islice(self.parses(word), k))
+
 def get_syllabifier():
 
     vowels = ['a', 'e', 'i', 'o', 'u', 'ü', 'ö', 'é']
@@ -117,7 +169,7 @@ def get_syllabifier():
               [('coda2', c, ['.{}'.format(c)], 'onset_comp_t') for c in comp_onsets_t] +
               [('coda2', '-', ['.'], 'start')])
 
-    uyghur_syllabifier = GenericAutomaton(
+    uyghur_syllabifier = Syllabifier(
         starts = [('start', ['']), ('onset', []), ('vowel', []), ('coda1', []), ('coda2', [])],
         ends = [('start', []), ('onset', []), ('vowel', ['']), ('coda1', ['']), ('coda2', [''])],
         deltas = deltas,
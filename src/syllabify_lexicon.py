@@ -0,0 +1,162 @@
+import argparse
+import collections
+import compiled_syllabifier
+import csv
+import itertools
+import multiprocessing
+import os
+import pron_dict
+import syllable_cache
+import time
+import tokenizer
+
+# Syllabifies every entry of the pronunciation dictionary, giving a
+# syllabified lexicon the TextGrid pipeline can look words up in rather
+# than parsing them.
+#
+# Each pronunciation is converted to Latin the same way process_textgrid.py
+# converts syllable labels (tokenizer.ipa_to_latin) and then to the
+# syllabifier's alphabet. The dictionary is read in chunks; every distinct
+# form is parsed once, by a pool of worker processes that each memory-map
+# the compiled syllabifier, and the rows of each chunk are written as soon
+# as its forms are back, so the output grows as the job runs.
+
+OUTPUT_PATH = 'data/syllabified_lexicon.tsv'
+COLUMNS = ['word', 'pron', 'latin', 'syllables', 'problem']
+
+def latin_form(pron):
+	# The Latin spelling of an IPA pronunciation from the dictionary
+	return tokenizer.ipa_to_latin.convert(pron.replace(' ', ''))
+
+def chunked(iterable, size):
+	iterator = iter(iterable)
+	while True:
+		chunk = list(itertools.islice(iterator, size))
+		if not chunk:
+			return
+		yield chunk
+
+# Each worker loads the compiled syllabifier once, in init_worker
+syller = None
+
+def init_worker():
+	global syller
+	syller = compiled_syllabifier.load_syllabifier()
+
+def parse_forms(forms):
+	# Returns the first parse of each form, or None if it can't be parsed
+	return [syller.first_parse(form) for form in forms]
+
+def plan(entries, chunk_size, seen, pending):
+	"""
+	Splits entries into chunks of (word, pron, latin, form) rows and yields,
+	for each chunk, the forms that haven't been seen in an earlier chunk.
+	(rows, forms) for each chunk is queued on pending, in the same order.
+	"""
+	for chunk in chunked(entries, chunk_size):
+		rows = []
+		forms = []
+		for (word, pron) in chunk:
+			latin = latin_form(pron)
+			form = tokenizer.latin_to_simple.convert(latin)
+			if form not in seen:
+				seen.add(form)
+				forms.append(form)
+			rows.append((word, pron, latin, form))
+		pending.append((rows, forms))
+		yield forms
+
+def run(entries, outfile, parses=None, jobs=None, chunk_size=1000):
+	"""
+	Syllabifies (word, pron) entries, writing a row per entry to outfile
+	(TSV, with the columns in COLUMNS) and recording the parse of every
+	distinct form in parses (form -> parse or None). Entries that can't be
+	parsed get an empty syllables column and a problem. Yields a report
+	after each chunk is written.
+	"""
+	if parses is None:
+		parses = {}
+	jobs = jobs or os.cpu_count()
+	pending = collections.deque()
+	work = plan(entries, chunk_size, set(parses), pending)
+
+	if jobs <= 1:
+		init_worker()
+		results = map(parse_forms, work)
+		pool = None
+	else:
+		# Build the compiled syllabifier here if it's out of date, rather
+		# than in every worker at once
+		compiled_syllabifier.ensure_compiled()
+		pool = multiprocessing.Pool(jobs, initializer=init_worker)
+		results = pool.imap(parse_forms, work)
+
+	start = time.time()
+	total = 0
+	try:
+		with open(outfile, 'w', newline='', encoding='utf-8') as f:
+			writer = csv.writer(f, delimiter='\t', lineterminator='\n')
+			writer.writerow(COLUMNS)
+			for forms_parsed in results:
+				rows, forms = pending.popleft()
+				parses.update(zip(forms, forms_parsed))
+
+				failed = 0
+				for (word, pron, latin, form) in rows:
+					parse = parses[form]
+					if parse is None:
+						failed += 1
+						writer.writerow([word, pron, latin, '', "Can't parse"])
+					else:
+						syllables = tokenizer.simple_to_latin.convert(parse)
+						writer.writerow([word, pron, latin, syllables, ''])
+				f.flush()
+
+				total += len(rows)
+				seconds = time.time() - start
+				yield {
+					'entries': len(rows),
+					'new_forms': len(forms_parsed),
+					'failed': failed,
+					'total': total,
+					'seconds': seconds,
+					'words_per_sec': total / seconds if seconds else 0.0
+				}
+	finally:
+		if pool is not None:
+			pool.terminate()
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+		description='Syllabify every entry of the pronunciation dictionary'
+	)
+	parser.add_argument('dict', nargs='?', default=pron_dict.DICT_PATH)
+	parser.add_argument('outfile', nargs='?', default=OUTPUT_PATH)
+	parser.add_argument(
+		'-j', '--jobs', type=int, default=None,
+		help='Number of worker processes (default: number of cores)'
+	)
+	parser.add_argument('--chunk-size', type=int, default=1000)
+	parser.add_argument(
+		'--seed-cache', action='store_true',
+		help='Add the parses to the syllabifier cache used by syllabify_textgrid.py'
+	)
+	args = parser.parse_args()
+
+	parses = {}
+	entries = failed = 0
+	for report in run(pron_dict.iter_dict(args.dict), args.outfile, parses,
+					  args.jobs, args.chunk_size):
+		entries = report['total']
+		failed += report['failed']
+		print("{} entries ({} new forms, {} failed), {:.0f} words/s".format(
+			entries, report['new_forms'], report['failed'], report['words_per_sec']
+		))
+	print("Wrote {}: {} entries, {} distinct forms, {} couldn't be parsed".format(
+		args.outfile, entries, len(parses), failed
+	))
+
+	if args.seed_cache:
+		with syllable_cache.CachedSyllabifier(compiled_syllabifier.load_syllabifier()) as cache:
+			cache.store(parses.items())
+		print("Added {} parses to {}".format(len(parses), syllable_cache.CACHE_PATH))
@@ -1,44 +1,82 @@
+import argparse
 import ara_to_lat
+import compiled_syllabifier
+import functools
+import glob
+import instrument
+import json
+import multiprocessing
 import re
-import syllabifier
+import syllable_cache
+import textgrid_io
 import tgt
+import tier_alignment
+import tokenizer
 import os
+import time
+import traceback
 
-# Fix ng issue
+def convert_ortho(word, reverse = False):
+	# Swaps the Latin digraphs (ng, sh, ...) for the single symbols the
+	# syllabifier uses, or back again
+	if reverse:
+		return tokenizer.simple_to_latin.convert(word)
+	return tokenizer.latin_to_simple.convert(word)
 
-simple_ortho_map = {
-	'ng': 'N',
-	'sh': 'S',
-	'ch': 'C',
-	'gh': 'G',
-	'zh': 'Z'
-}
+def read_textgrid(textgrid_file):
+	# Praat seems to randomly alternate between using utf-16 and utf-8, so
+	# textgrid_io works out which from the start of the file
+	return textgrid_io.read_textgrid(textgrid_file)
 
-def convert_ortho(word, reverse = False):
-	for key, val in simple_ortho_map.items():
-		if reverse:
-			word = re.sub(val, key, word)
-		else:
-			word = re.sub(key, val, word)
-	return word
-
-textgrid_files = [
-	#"data/textgrids_to_syllabify/5004_5005_CONGEST_UYGHUR_INTERVIEW.TextGrid",
-	#'data/textgrids_to_syllabify/5006_5007_CONGEST_UYGHUR_INTERVIEW_INPUT1.TextGrid', # DONE
-	"data/textgrids_to_syllabify/5006_5007_CONGEST_UYGHUR_INTERVIEW_INPUT2.TextGrid", 
-	#'data/textgrids_to_syllabify/5008_5009_CONGEST_UYGHUR_INTERVIEW_INPUT1.TextGrid',
-	# "data/textgrids_to_syllabify/5008_5009_CONGEST_UYGHUR_INTERVIEW_INPUT2.TextGrid", # DONE
-	#"data/textgrids_to_syllabify/uyghur_conversation.TextGrid", # DONE
-]
-for textgrid_file in textgrid_files:
-	# Praat seems to randomly alternate between using utf-16 and utf-8...
-	try:
-		textgrid = tgt.read_textgrid(textgrid_file, encoding='utf-16')
-	except:
-		textgrid = tgt.read_textgrid(textgrid_file, encoding='utf-8')
+def syllabify_word(text, phone_intervals, transducer, syller):
+	"""
+	Converts the text of a word interval to Latin and syllabifies it,
+	splitting phone_intervals (the phones inside the word) into syllables.
+	Returns the Latin text (syllabified if it could be), a list of
+	(start_time, end_time, text) syllables, and a description of the
+	problem if there was one. Laughter, unknown words and the like are
+	returned with no syllables and no problem.
+	"""
+	# Convert interval text to Latin
+	text = ara_to_lat.convert_word(transducer, text)
 
-	transducer = ara_to_lat.load_transducer()
-	syller = syllabifier.get_syllabifier()
+	if '?' in text or text in ('laughter', 'spn'):
+		return text, [], None
+
+	# Syllabify word
+	simple_word = convert_ortho(text)
+	parsed = syller.first_parse_boundaries(simple_word)
+	if parsed is None:
+		return text, [], "Can't parse"
+	simple_syllabified, boundaries = parsed
+
+	text = convert_ortho(simple_syllabified, reverse = True)
+	if len(phone_intervals) != len(re.sub("['-]", "", simple_word)):
+		return text, [], 'Mismatched number of intervals: {} phones'.format(
+			len(phone_intervals)
+		)
+
+	# Each syllable is the slice of phones between two boundaries, and
+	# starts where the one before it ends
+	cuts = [0] + list(boundaries) + [len(phone_intervals)]
+	syllables = []
+	start_time = phone_intervals[0].start_time
+	for (start, end) in zip(cuts, cuts[1:]):
+		end_time = phone_intervals[end - 1].end_time
+		syllables.append((
+			start_time, end_time,
+			''.join(phone.text for phone in phone_intervals[start:end])
+		))
+		start_time = end_time
+	return text, syllables, None
+
+def syllabify_textgrid(textgrid, transducer, syller):
+	"""
+	Converts the words and utterances in textgrid to Latin, syllabifies the
+	words, and adds a syllable tier after each word tier. Returns a list of
+	the intervals that couldn't be processed, which are left unsyllabified.
+	"""
+	problems = []
 
 	for tier_name in textgrid.get_tier_names():
 		if 'words' in tier_name:
@@ -52,67 +90,182 @@ for textgrid_file in textgrid_files:
 			textgrid.insert_tier(syl_tier, tier_pos + 1)
 
 			tier = textgrid.get_tier_by_name(tier_name)
+			if prefix:
+				phone_tier_name = '{} - phones'.format(prefix)
+			else:
+				phone_tier_name = 'phones'
+			phone_tier = textgrid.get_tier_by_name(phone_tier_name)
 
-			for interval in tier:
-				# Convert interval text to Latin
-				interval.text = ara_to_lat.convert_word(transducer, interval.text)
-
-				if '?' in interval.text or interval.text in ('laughter', 'spn'):
-					continue
-
-				# Syllabify word
-				simple_word = convert_ortho(interval.text)
-				simple_syllabified = syller.val_b(simple_word)
-				if not simple_syllabified:
-					breakpoint()
-					print("Can't parse: {}".format(simple_word))
-					continue
-				else:
-					simple_syllabified = simple_syllabified[0]
-
-				interval.text = convert_ortho(
-					simple_syllabified, reverse = True
-				)
-				if prefix:
-					phone_tier_name = '{} - phones'.format(prefix)
-				else:
-					phone_tier_name = 'phones'
-				phone_tier = textgrid.get_tier_by_name(phone_tier_name)
-				phone_intervals = phone_tier.get_annotations_between_timepoints(
-					interval.start_time - 0.01, interval.end_time + 0.01
+			# Find the phones in every word in one pass over both tiers
+			word_intervals = list(tier)
+			word_phones = tier_alignment.intervals_within(
+				word_intervals, list(phone_tier)
+			)
+
+			for interval, phone_intervals in zip(word_intervals, word_phones):
+				interval.text, syllables, problem = syllabify_word(
+					interval.text, phone_intervals, transducer, syller
 				)
-				if len(phone_intervals) != len(re.sub("['-]", "", simple_word)):
-					breakpoint()
-					print("Mismatched number of intervals: {}".format(simple_word))
-					continue
-				
-				start_time = phone_intervals[0].start_time
-				cur_idx = 0
-				syl_str = ''
-				for segment in simple_syllabified:
-					if segment == '.':
-						end_time = phone_intervals[cur_idx - 1].end_time
-						interval = tgt.core.Interval(start_time, end_time, syl_str)
-						syl_tier.add_interval(interval)
-						start_time = end_time
-						syl_str = ''
-					elif segment == "'" or segment == "-":
-						pass
-					else:
-						syl_str += phone_intervals[cur_idx].text
-						cur_idx += 1
-
-				end_time = phone_intervals[-1].end_time
-				interval = tgt.core.Interval(start_time, end_time, syl_str)
-				syl_tier.add_interval(interval)
+				if problem:
+					problems.append({
+						'tier': tier_name,
+						'start_time': interval.start_time,
+						'end_time': interval.end_time,
+						'text': interval.text,
+						'problem': problem
+					})
+				for (start_time, end_time, syl_str) in syllables:
+					syl_tier.add_interval(tgt.core.Interval(start_time, end_time, syl_str))
 
 		elif 'utterances' in tier_name:
 			tier = textgrid.get_tier_by_name(tier_name)
 			for interval in tier:
 				try:
 					interval.text = ara_to_lat.convert_sentence(transducer, interval.text)
-				except:
-					breakpoint()
-					print("Couldn't parse interval {}".format(interval.text))
-	outname = os.path.splitext(textgrid_file)[0] + '_syllabified.TextGrid'
-	tgt.write_to_file(textgrid, outname)
+				except Exception as e:
+					problems.append({
+						'tier': tier_name,
+						'start_time': interval.start_time,
+						'end_time': interval.end_time,
+						'text': interval.text,
+						'problem': "Couldn't parse interval: {}".format(e)
+					})
+
+	return problems
+
+def output_path(textgrid_file, outdir=None):
+	outname = os.path.splitext(os.path.basename(textgrid_file))[0] + '_syllabified.TextGrid'
+	return os.path.join(outdir or os.path.dirname(textgrid_file), outname)
+
+# Each worker process loads the transducer and syllabifier once, in
+# init_worker, and reuses them for every file it's given
+transducer = None
+syller = None
+
+def init_worker():
+	global transducer, syller
+	instrument.enable_from_env()
+	transducer = ara_to_lat.load_transducer()
+	syller = syllable_cache.CachedSyllabifier(
+		compiled_syllabifier.load_syllabifier()
+	)
+
+def process_file(textgrid_file, outdir=None):
+	"""
+	Syllabifies one TextGrid and writes the result. Any intervals that
+	couldn't be processed are written to a .quarantine.json file next to the
+	output. Returns a summary of what happened; errors are reported there
+	rather than raised, so one bad file doesn't stop the others.
+	"""
+	start = time.time()
+	outname = output_path(textgrid_file, outdir)
+	report = {'file': textgrid_file, 'output': outname}
+	instrument.reset()
+	try:
+		with instrument.timer('process_file'):
+			textgrid = read_textgrid(textgrid_file)
+			with instrument.timer('syllabify_textgrid'):
+				problems = syllabify_textgrid(textgrid, transducer, syller)
+			with instrument.timer('flush_cache'):
+				syller.flush()
+			textgrid_io.write_textgrid(textgrid, outname)
+	except Exception:
+		report['error'] = traceback.format_exc()
+		report['output'] = None
+		problems = []
+		# The words parsed before the error are still worth keeping
+		syller.flush()
+
+	quarantine = os.path.splitext(outname)[0] + '.quarantine.json'
+	if problems:
+		with open(quarantine, 'w', encoding='utf-8') as f:
+			json.dump(problems, f, ensure_ascii=False, indent=1)
+		report['quarantine'] = quarantine
+	elif os.path.exists(quarantine):
+		os.remove(quarantine)
+
+	report['problems'] = len(problems)
+	report['seconds'] = time.time() - start
+	if instrument.enabled:
+		report['profile'] = instrument.write_report(
+			os.path.splitext(outname)[0] + '.profile.json',
+			file=textgrid_file, seconds=report['seconds']
+		)
+	return report
+
+def find_textgrids(paths):
+	# Expands directories and glob patterns into a list of TextGrid files,
+	# leaving out anything that's already an output of this script
+	files = []
+	for path in paths:
+		if os.path.isdir(path):
+			matches = glob.glob(os.path.join(path, '*.TextGrid'))
+		else:
+			matches = glob.glob(path)
+		files.extend(
+			x for x in sorted(matches) if not x.endswith('_syllabified.TextGrid')
+		)
+	return files
+
+def run(textgrid_files, outdir=None, jobs=None):
+	# Processes textgrid_files over a pool of jobs worker processes (all
+	# cores by default), yielding a report for each file as it finishes
+	if outdir:
+		os.makedirs(outdir, exist_ok=True)
+	jobs = min(jobs or os.cpu_count(), len(textgrid_files))
+
+	if jobs <= 1:
+		init_worker()
+		# Closed even if the caller stops early or something raises
+		try:
+			for textgrid_file in textgrid_files:
+				yield process_file(textgrid_file, outdir)
+		finally:
+			syller.close()
+		return
+
+	# Build the compiled syllabifier here if it's out of date, rather than
+	# in every worker at once
+	compiled_syllabifier.ensure_compiled()
+	with multiprocessing.Pool(jobs, initializer=init_worker) as pool:
+		work = functools.partial(process_file, outdir=outdir)
+		for report in pool.imap_unordered(work, textgrid_files):
+			yield report
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+		description='Convert TextGrids to Latin and add syllable tiers'
+	)
+	parser.add_argument(
+		'paths', nargs='*', default=['data/textgrids_to_syllabify'],
+		help='TextGrid files, directories or glob patterns'
+	)
+	parser.add_argument(
+		'--outdir', default=None,
+		help='Where to write the output (default: next to each input)'
+	)
+	parser.add_argument(
+		'-j', '--jobs', type=int, default=None,
+		help='Number of worker processes (default: number of cores)'
+	)
+	parser.add_argument(
+		'--profile', action='store_true',
+		help='Write a timing report for each file next to its output (also '
+			 'turned on by setting {})'.format(instrument.ENV_VAR)
+	)
+	args = parser.parse_args()
+	if args.profile:
+		# Set in the environment so the worker processes see it too
+		os.environ[instrument.ENV_VAR] = '1'
+
+	textgrid_files = find_textgrids(args.paths)
+	failed = 0
+	for report in run(textgrid_files, args.outdir, args.jobs):
+		if 'error' in report:
+			failed += 1
+			print("FAILED {}:\n{}".format(report['file'], report['error']))
+		else:
+			print("{} -> {} ({} problems, {:.1f}s)".format(
+				report['file'], report['output'], report['problems'], report['seconds']
+			))
+	print("Processed {} files, {} failed".format(len(textgrid_files), failed))
@@ -0,0 +1,134 @@
+import functools
+import hashlib
+import sqlite3
+import sys
+from syllabifier import Syllabifier, parse_boundaries
+import unicodedata
+
+# The same words turn up thousands of times across the interview TextGrids,
+# so syllabifications are memoized twice: in an in-process LRU cache, and in
+# an sqlite file that persists between runs. Entries are keyed on the
+# normalized word and the fingerprint of the syllabifier, so editing
+# get_syllabifier() automatically invalidates everything cached with the
+# old definition. The fingerprint only covers the automaton, though, and
+# which parse comes first also depends on the code that enumerates them
+# (Syllabifier.paths), so the key includes a hash of that code too.
+#
+# Several processes (syllabify_textgrid.py -j N, the service) can share the
+# file. It's opened in WAL mode, so reads never wait for a writer, and new
+# parses are held in memory until flush() writes them all in one short
+# transaction; no transaction is left open between calls.
+
+CACHE_PATH = 'data/syllabifier_cache.sqlite'
+
+# Change this if what's stored for a word changes
+CACHE_VERSION = 1
+
+def parser_version():
+	# A hash of CACHE_VERSION and the source files of Syllabifier and its
+	# base classes. CompiledSyllabifier gives the same parses in the same
+	# order, so both share one version and one set of cached entries.
+	h = hashlib.sha1(str(CACHE_VERSION).encode())
+	for cls in Syllabifier.__mro__[:-1]:
+		with open(sys.modules[cls.__module__].__file__, 'rb') as f:
+			h.update(f.read())
+	return h.hexdigest()
+
+def normalize(word):
+	return unicodedata.normalize('NFC', word.strip())
+
+class CachedSyllabifier():
+	def __init__(self, syllabifier, path=CACHE_PATH, maxsize=100000):
+		self.syllabifier = syllabifier
+		self.fingerprint = '{}:{}'.format(syllabifier.fingerprint(), parser_version())
+		self.hits = 0
+		self.misses = 0
+		# Parses not yet written to the database
+		self.pending = {}
+
+		self.db = sqlite3.connect(path, timeout=60)
+		self.db.execute('PRAGMA journal_mode=WAL')
+		with self.db:
+			self.db.execute(
+				'CREATE TABLE IF NOT EXISTS syllabifications ('
+				'fingerprint TEXT, word TEXT, parse TEXT, '
+				'PRIMARY KEY (fingerprint, word))'
+			)
+			# Anything cached by an older version of the syllabifier, or of
+			# the code that parses with it, can never be used again
+			self.db.execute(
+				'DELETE FROM syllabifications WHERE fingerprint != ?',
+				(self.fingerprint,)
+			)
+
+		self.lookup = functools.lru_cache(maxsize=maxsize)(self._lookup)
+		self.parse_boundaries = functools.lru_cache(maxsize=maxsize)(
+			parse_boundaries
+		)
+
+	def _lookup(self, word):
+		if word in self.pending:
+			return self.pending[word]
+		row = self.db.execute(
+			'SELECT parse FROM syllabifications WHERE fingerprint = ? AND word = ?',
+			(self.fingerprint, word)
+		).fetchone()
+		if row:
+			self.hits += 1
+			return row[0]
+
+		# Words that can't be parsed are stored as NULL, so failures are
+		# cached too
+		self.misses += 1
+		parse = self.syllabifier.first_parse(word)
+		self.pending[word] = parse
+		return parse
+
+	def first_parse(self, word):
+		# Same as Syllabifier.first_parse, but answered from the cache
+		# when possible
+		return self.lookup(normalize(word))
+
+	def first_parse_boundaries(self, word):
+		# Same as Syllabifier.first_parse_boundaries, with the boundaries
+		# worked out once per distinct parse
+		parse = self.first_parse(word)
+		if parse is None:
+			return None
+		return parse, self.parse_boundaries(parse)
+
+	def cache_info(self):
+		# How lookups were answered: from the in-process LRU cache, from the
+		# database, or by parsing. hits and misses only count the last two,
+		# which are the LRU cache's misses.
+		return {
+			'memory_hits': self.lookup.cache_info().hits,
+			'db_hits': self.hits,
+			'misses': self.misses
+		}
+
+	def store(self, parses):
+		# Adds (word, parse) pairs that were syllabified elsewhere, e.g. by
+		# syllabify_lexicon.py, so they never have to be parsed here
+		with self.db:
+			self.db.executemany(
+				'INSERT OR REPLACE INTO syllabifications VALUES (?, ?, ?)',
+				((self.fingerprint, normalize(word), parse) for (word, parse) in parses)
+			)
+
+	def flush(self):
+		# Writes any new entries to disk. If that fails they're kept, to be
+		# written by the next flush.
+		if self.pending:
+			self.store(self.pending.items())
+			self.pending.clear()
+
+	def close(self):
+		self.flush()
+		self.db.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
@@ -0,0 +1,154 @@
+import csv
+import re
+import numpy as np
+
+# Feature extraction for syllable_data.csv. Rather than looking at prefix
+# and suffix slices of each word once per syllable, every word is split
+# into syllables once, and all features are computed with array operations
+# over every syllable in the tier at the same time. Features are collected
+# into a columnar table: a dictionary from column names to NumPy arrays.
+
+VOWELS = ('a', 'e', 'i', 'o', 'u', 'ü', 'ö', 'é')
+
+def check_heavy(syl):
+	return not syl[-1] in VOWELS
+
+# Columns copied straight from the input
+BASE_COLUMNS = ['subject', 'word', 'syllable', 'start_time', 'end_time']
+
+# Computed columns, in output order. Each entry is (name, function), where
+# the function takes the dictionary of arrays built by build_table and
+# returns an array with one value per syllable. Use the feature decorator
+# to add new ones.
+FEATURES = []
+
+def feature(name):
+	def register(function):
+		FEATURES.append((name, function))
+		return function
+	return register
+
+@feature('word_len_syls')
+def word_len_syls(s):
+	return s['word_len']
+
+@feature('syl_position')
+def syl_position(s):
+	return s['position']
+
+@feature('closed_syl')
+def closed_syl(s):
+	return s['closed']
+
+@feature('is_initial')
+def is_initial(s):
+	return s['position'] == 0
+
+@feature('is_final')
+def is_final(s):
+	return s['position'] == s['word_len'] - 1
+
+@feature('is_penultimate')
+def is_penultimate(s):
+	return s['position'] == s['word_len'] - 2
+
+@feature('is_first_heavy')
+def is_first_heavy(s):
+	return s['closed'] & (s['heavy_before'] == 0)
+
+@feature('is_last_heavy')
+def is_last_heavy(s):
+	return s['closed'] & (s['heavy_after'] == 0)
+
+@feature('preceding_heavy')
+def preceding_heavy(s):
+	return s['heavy_before'] > 0
+
+@feature('following_heavy')
+def following_heavy(s):
+	return s['heavy_after'] > 0
+
+@feature('gesture')
+def gesture(s):
+	return np.zeros(len(s['position']), dtype=int)
+
+def build_table(columns):
+	"""
+	Computes the feature table for a list of syllables. columns is a
+	dictionary of equal-length lists:
+		subject, word, syllable, start_time, end_time: copied to the output
+		uyg_syllable: the syllable label converted to Uyghur Latin
+		word_key: identifies the word token each syllable belongs to; a
+			run of consecutive syllables with the same key is one word
+	A syllable's position is its place in that run, so a syllable that
+	appears twice in a word gets the right position both times.
+	"""
+	n = len(columns['word_key'])
+
+	# Positions within each run of syllables belonging to the same word
+	position = np.zeros(n, dtype=int)
+	word_index = np.zeros(n, dtype=int)
+	word_texts = []
+	for i in range(n):
+		if i > 0 and columns['word_key'][i] == columns['word_key'][i - 1]:
+			position[i] = position[i - 1] + 1
+			word_index[i] = word_index[i - 1]
+		else:
+			word_index[i] = len(word_texts)
+			word_texts.append(columns['word'][i])
+
+	# Split every word into syllables once, and lay all of them out in one
+	# flat array. heavy_count[k] is the number of heavy syllables among the
+	# first k entries of that array.
+	word_syllables = [
+		[re.sub("'", "", x) for x in word.split('.')] for word in word_texts
+	]
+	word_len = np.array([len(syls) for syls in word_syllables], dtype=int)
+	word_start = np.concatenate(([0], np.cumsum(word_len)[:-1])).astype(int)
+	heavy = np.array(
+		[check_heavy(x) for syls in word_syllables for x in syls], dtype=bool
+	)
+	heavy_count = np.concatenate(([0], np.cumsum(heavy))).astype(int)
+
+	starts = word_start[word_index]
+	ends = starts + word_len[word_index]
+	# Don't index past the end of a word if the tier has more syllables in
+	# it than the word's transcription does
+	flat_position = np.minimum(starts + position, ends - 1)
+
+	syllables = {
+		'position': position,
+		'word_len': word_len[word_index],
+		'closed': np.array(
+			[check_heavy(x) for x in columns['uyg_syllable']], dtype=bool
+		),
+		'heavy_before': heavy_count[flat_position] - heavy_count[starts],
+		'heavy_after': heavy_count[ends] - heavy_count[flat_position + 1]
+	}
+
+	table = {name: np.array(columns[name]) for name in BASE_COLUMNS}
+	for name, function in FEATURES:
+		table[name] = function(syllables)
+	return table
+
+def check_table(table):
+	# Reports words whose transcription has a different number of syllables
+	# from the syllable tier
+	for i in np.flatnonzero(table['syl_position'] >= table['word_len_syls']):
+		print("More syllables than expected in {}: {}".format(
+			table['word'][i], table['syllable'][i]
+		))
+
+def write_csv(table, outfile, missing=None):
+	# missing, if given, is written in place of NaN in float columns (e.g.
+	# '--undefined--', as ProsodyPro writes, so R still reads it as NA)
+	columns = []
+	for values in table.values():
+		column = values.tolist()
+		if missing is not None and values.dtype.kind == 'f':
+			column = [missing if x != x else x for x in column]
+		columns.append(column)
+	with open(outfile, 'w') as f:
+		writer = csv.writer(f)
+		writer.writerow(list(table))
+		writer.writerows(zip(*columns))
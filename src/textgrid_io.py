@@ -0,0 +1,314 @@
+import argparse
+import codecs
+import collections
+import glob
+import io
+import os
+import time
+import tgt
+import tracemalloc
+
+# Streaming reader and writer for Praat TextGrids.
+#
+# Praat saves TextGrids as UTF-8 or UTF-16 more or less at random, so the
+# encoding is worked out from the first few bytes of the file instead of by
+# trying one and reparsing on failure. Both the long and short text formats
+# are read by the same tokenizer, and tiers are read lazily: each tier is a
+# generator over its intervals, and tiers that aren't iterated over are
+# skipped without building any objects for them.
+
+Interval = collections.namedtuple('Interval', ['start_time', 'end_time', 'text'])
+Point = collections.namedtuple('Point', ['time', 'text'])
+
+BOMS = [
+	(codecs.BOM_UTF8, 'utf-8-sig'),
+	(codecs.BOM_UTF16_LE, 'utf-16'),
+	(codecs.BOM_UTF16_BE, 'utf-16')
+]
+
+# Same as tgt.core.Time: boundaries closer together than this are the same
+PRECISION = 0.0001
+
+def detect_encoding(head):
+	"""
+	Guesses the encoding of a TextGrid from its first bytes: a BOM if there
+	is one, and otherwise the zero bytes UTF-16 puts in the ASCII header
+	"""
+	for bom, encoding in BOMS:
+		if head.startswith(bom):
+			return encoding
+	if len(head) >= 2 and head[0] == 0:
+		return 'utf-16-be'
+	if len(head) >= 2 and head[1] == 0:
+		return 'utf-16-le'
+	return 'utf-8'
+
+def open_textgrid(path):
+	raw = open(path, 'rb')
+	encoding = detect_encoding(raw.read(4))
+	raw.seek(0)
+	return io.TextIOWrapper(raw, encoding=encoding)
+
+def tokens(lines):
+	"""
+	Yields the values in a TextGrid, in file order. In the long format a
+	value is whatever follows 'label =' (or the flag in 'tiers? <exists>');
+	in the short format every line is a value. Lines that are only labels,
+	like 'item [1]:', are skipped.
+	"""
+	lines = iter(lines)
+	for line in lines:
+		line = line.strip()
+		if not line:
+			continue
+		if line[0] != '"' and '=' in line:
+			line = line.split('=', 1)[1].strip()
+		elif line.endswith('<exists>') or line.endswith('<absent>'):
+			line = line.split()[-1]
+		elif line[0] != '"' and line[0] != '-' and not line[0].isdigit():
+			continue
+
+		# Strings can run over several lines. A complete one has an even
+		# number of quotes, since quotes inside it are doubled. It ends at
+		# its closing quote: anything after that on the last line (like the
+		# space Praat writes there) isn't part of it.
+		if line.startswith('"') and line.count('"') % 2:
+			while line.count('"') % 2:
+				line += '\n' + next(lines).rstrip('\r\n')
+			line = line[:line.rindex('"') + 1]
+		yield line
+
+def unquote(token):
+	return token[1:-1].replace('""', '"')
+
+class Tier():
+	"""
+	One tier of a TextGridReader. Iterating over it yields its intervals
+	(or points) in order; this can only be done once, and only until the
+	reader moves on to the next tier.
+	"""
+	def __init__(self, tokens, include_empty):
+		self.tier_class = unquote(next(tokens))
+		self.name = unquote(next(tokens))
+		self.start_time = float(next(tokens))
+		self.end_time = float(next(tokens))
+		self.size = int(next(tokens))
+		self.include_empty = include_empty
+		self.items = self.read(tokens)
+
+	def read(self, tokens):
+		for _ in range(self.size):
+			if self.tier_class == 'IntervalTier':
+				start_time = float(next(tokens))
+				end_time = float(next(tokens))
+				text = unquote(next(tokens))
+				# Like tgt, leave out empty intervals unless asked for them
+				if self.include_empty or text.strip() != '':
+					yield Interval(start_time, end_time, text)
+			else:
+				time = float(next(tokens))
+				yield Point(time, unquote(next(tokens)))
+
+	def __iter__(self):
+		return self.items
+
+	def skip(self):
+		for _ in self.items:
+			pass
+
+class TextGridReader():
+	"""
+	Reads a TextGrid in either text format and encoding. Iterating over
+	the reader yields its tiers in order:
+
+		with TextGridReader(path) as reader:
+			for tier in reader:
+				if tier.name == 'A - words':
+					words = list(tier)
+	"""
+	def __init__(self, path, include_empty=False):
+		self.path = path
+		self.include_empty = include_empty
+		self.file = open_textgrid(path)
+		self.tokens = tokens(self.file)
+
+		header = [unquote(next(self.tokens)), unquote(next(self.tokens))]
+		if header[0] not in ('ooTextFile', 'ooTextFile short') or header[1] != 'TextGrid':
+			raise ValueError('Invalid TextGrid header in {}: {}'.format(path, header))
+		self.start_time = float(next(self.tokens))
+		self.end_time = float(next(self.tokens))
+		if next(self.tokens) == '<exists>':
+			self.size = int(next(self.tokens))
+		else:
+			self.size = 0
+
+	def __iter__(self):
+		for _ in range(self.size):
+			tier = Tier(self.tokens, self.include_empty)
+			yield tier
+			tier.skip()
+
+	def close(self):
+		self.file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+def read_textgrid(path, include_empty=False):
+	"""
+	Reads a whole TextGrid into a tgt.TextGrid, for code that needs to
+	modify it. This reads the file once whatever its encoding.
+	"""
+	textgrid = tgt.core.TextGrid(path)
+	with TextGridReader(path, include_empty) as reader:
+		for tier in reader:
+			if tier.tier_class == 'IntervalTier':
+				tgt_tier = tgt.core.IntervalTier(tier.start_time, tier.end_time, tier.name)
+				tgt_tier.add_annotations([
+					tgt.core.Interval(x.start_time, x.end_time, x.text) for x in tier
+				])
+			else:
+				tgt_tier = tgt.core.PointTier(tier.start_time, tier.end_time, tier.name)
+				tgt_tier.add_annotations([
+					tgt.core.Point(x.time, x.text) for x in tier
+				])
+			textgrid.add_tier(tgt_tier)
+	return textgrid
+
+def fill_gaps(intervals, start_time, end_time):
+	# Returns the intervals with empty ones added wherever there's a gap
+	# between start_time and end_time, as Praat expects
+	filled = []
+	time = start_time
+	for interval in intervals:
+		if interval.start_time - time >= PRECISION:
+			filled.append(Interval(time, interval.start_time, ''))
+		filled.append(interval)
+		time = interval.end_time
+	if end_time - time >= PRECISION or not filled:
+		filled.append(Interval(time, end_time, ''))
+	return filled
+
+class TextGridWriter():
+	"""
+	Writes a short-format TextGrid one tier at a time, so the file never
+	has to be held in memory as a whole. The output is the same as
+	tgt.write_to_file's.
+	"""
+	def __init__(self, path, start_time, end_time, size, encoding='utf-8'):
+		self.file = open(path, 'w', encoding=encoding, newline='')
+		self.start_time = start_time
+		self.end_time = end_time
+		self.size = size
+		self.written = 0
+		self.file.write('File type = "ooTextFile"\nObject class = "TextGrid"')
+		self.write_values(['', start_time, end_time, '<exists>', size])
+
+	def write_values(self, values):
+		self.file.write('\n' + '\n'.join(str(x) for x in values))
+
+	def quote(self, text):
+		return '"' + text.replace('"', '""') + '"'
+
+	def write_tier(self, name, intervals):
+		intervals = fill_gaps(intervals, self.start_time, self.end_time)
+		self.write_values([
+			'"IntervalTier"', self.quote(name),
+			min(self.start_time, intervals[0].start_time),
+			max(self.end_time, intervals[-1].end_time),
+			len(intervals)
+		])
+		for interval in intervals:
+			self.write_values([
+				interval.start_time, interval.end_time, self.quote(interval.text)
+			])
+		self.written += 1
+
+	def write_point_tier(self, name, points):
+		points = list(points)
+		self.write_values([
+			'"TextTier"', self.quote(name), self.start_time, self.end_time, len(points)
+		])
+		for point in points:
+			self.write_values([point.time, self.quote(point.text)])
+		self.written += 1
+
+	def close(self):
+		self.file.close()
+		if self.written != self.size:
+			raise ValueError('Wrote {} tiers to a TextGrid declared with {}'.format(
+				self.written, self.size
+			))
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+def write_textgrid(textgrid, path, encoding='utf-8'):
+	# Writes a tgt.TextGrid tier by tier, without copying it first like
+	# tgt.write_to_file does
+	with TextGridWriter(path, textgrid.start_time, textgrid.end_time,
+						len(textgrid.tiers), encoding) as writer:
+		for tier in textgrid:
+			if isinstance(tier, tgt.core.IntervalTier):
+				writer.write_tier(tier.name, tier.intervals)
+			else:
+				writer.write_point_tier(tier.name, tier.points)
+
+def benchmark(paths, repeats=3):
+	"""
+	Compares parse time and peak memory of tgt and the streaming reader
+	on each TextGrid in paths. The streaming reader is timed both reading
+	every interval and building a tgt.TextGrid with read_textgrid.
+	"""
+	def tgt_read(path):
+		try:
+			return tgt.read_textgrid(path, encoding='utf-16')
+		except Exception:
+			return tgt.read_textgrid(path, encoding='utf-8')
+
+	def stream_read(path):
+		with TextGridReader(path) as reader:
+			for tier in reader:
+				for _ in tier:
+					pass
+
+	readers = [('tgt', tgt_read), ('stream', stream_read), ('stream_tgt', read_textgrid)]
+	results = []
+	for path in paths:
+		result = {'file': path, 'bytes': os.path.getsize(path)}
+		for name, read in readers:
+			start = time.perf_counter()
+			for _ in range(repeats):
+				read(path)
+			result[name + '_seconds'] = (time.perf_counter() - start) / repeats
+
+			tracemalloc.start()
+			read(path)
+			result[name + '_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+			tracemalloc.stop()
+		results.append(result)
+	return results
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+		description='Benchmark the streaming TextGrid reader against tgt'
+	)
+	parser.add_argument(
+		'paths', nargs='*', default=['data/textgrids_to_syllabify/*.TextGrid']
+	)
+	parser.add_argument('--repeats', type=int, default=3)
+	args = parser.parse_args()
+
+	paths = sorted(x for pattern in args.paths for x in glob.glob(pattern))
+	for result in benchmark(paths, args.repeats):
+		print("{}: {:.0f} KB".format(result['file'], result['bytes'] / 1024))
+		for name in ('tgt', 'stream', 'stream_tgt'):
+			print("  {:10} {:7.3f}s  peak {:7.1f} MB".format(
+				name, result[name + '_seconds'], result[name + '_peak_bytes'] / 2**20
+			))
@@ -0,0 +1,74 @@
+# Alignment between TextGrid tiers (words, syllables, phones).
+#
+# tgt's get_annotations_by_time and get_annotations_between_timepoints
+# rebuild the tier's lists of start and end times on every call, so looking
+# something up for every interval of a tier is quadratic. The functions here
+# instead do a single merge-style pass over two tiers, which is linear once
+# the intervals are in time order (which they always are within a tier).
+# Intervals can be anything with start_time and end_time attributes.
+
+# Praat boundaries on different tiers that should coincide are often a few
+# milliseconds apart, so contained intervals may stick out by this much
+TOLERANCE = 0.01
+
+def containing_intervals(points, intervals):
+	"""
+	For each time in points, returns the last interval that spans it
+	(start_time <= time <= end_time), or None if there is none. This is
+	tier.get_annotations_by_time(time)[-1] for every point at once: at a
+	boundary shared by two intervals the later one wins.
+	"""
+	order = sorted(range(len(points)), key=points.__getitem__)
+	result = [None] * len(points)
+	j = 0
+	for i in order:
+		time = points[i]
+		# Move past every interval that starts at or before this point; the
+		# last of them is the only one that can contain it
+		while j < len(intervals) and intervals[j].start_time <= time:
+			j += 1
+		if j > 0 and intervals[j - 1].end_time >= time:
+			result[i] = intervals[j - 1]
+	return result
+
+def intervals_within(outer, inner, tolerance=TOLERANCE):
+	"""
+	For each interval in outer, returns the list of inner intervals that
+	lie inside it, allowing them to stick out by up to tolerance on either
+	side. This is tier.get_annotations_between_timepoints(start - tolerance,
+	end + tolerance) for every outer interval at once, so an inner interval
+	within tolerance of a shared boundary can belong to both neighbours.
+	Both lists must be in time order.
+	"""
+	result = []
+	lo = 0
+	for interval in outer:
+		start = interval.start_time - tolerance
+		end = interval.end_time + tolerance
+		while lo < len(inner) and inner[lo].start_time < start:
+			lo += 1
+
+		contained = []
+		j = lo
+		while j < len(inner) and inner[j].start_time <= end:
+			if inner[j].end_time <= end:
+				contained.append(inner[j])
+			j += 1
+		result.append(contained)
+	return result
+
+def align_tiers(words, syllables, phones, tolerance=TOLERANCE):
+	"""
+	Aligns a word, syllable and phone tier in one pass each. Returns three
+	lists parallel to the tiers they describe: the syllables of each word,
+	the phones of each syllable, and the word containing each syllable's
+	midpoint (None if there is none).
+	"""
+	midpoints = [
+		s.start_time + (s.end_time - s.start_time) / 2 for s in syllables
+	]
+	return (
+		intervals_within(words, syllables, tolerance),
+		intervals_within(syllables, phones, tolerance),
+		containing_intervals(midpoints, words)
+	)
@@ -0,0 +1,103 @@
+import ara_to_lat
+import functools
+
+# Longest-match conversions between IPA, Uyghur Latin (ULY) and the
+# simplified Latin the syllabifier reads, where each digraph is a single
+# symbol (ng -> N, sh -> S, ...). Each conversion is one left-to-right pass
+# over a trie built once from its table, so it takes time linear in the
+# length of the string. The most recent conversions are memoized, with a
+# bounded LRU cache so that long-running processes (service.py) don't grow
+# without limit.
+
+# IPA to ULY. This used to be four tables applied one after the other with
+# re.sub (y -> ü before j -> y before d͡ʒ -> j); as a single longest-match
+# table the affricates are matched before their parts and nothing is
+# rewritten twice, so the order no longer matters.
+IPA_TO_LATIN = {
+	'a': 'a',
+	'b': 'b',
+	'd': 'd',
+	'e': 'é',
+	'f': 'f',
+	'h': 'h',
+	'i': 'i',
+	'j': 'y',
+	'k': 'k',
+	'l': 'l',
+	'm': 'm',
+	'n': 'n',
+	'o': 'o',
+	'p': 'p',
+	'q': 'q',
+	'r': 'r',
+	's': 's',
+	't': 't',
+	'u': 'u',
+	'w': 'w',
+	'y': 'ü',
+	'ø': 'ö',
+	'ŋ': 'ng',
+	'ɛ': 'e',
+	'ɡ': 'g',
+	'ʁ': 'gh',
+	'ʃ': 'sh',
+	'ʒ': 'zh',
+	'χ': 'x',
+	'd͡ʒ': 'j',
+	't͡ʃ': 'ch'
+}
+
+# ULY digraphs and the single symbols the syllabifier uses for them
+LATIN_TO_SIMPLE = {
+	'ng': 'N',
+	'sh': 'S',
+	'ch': 'C',
+	'gh': 'G',
+	'zh': 'Z'
+}
+
+class Tokenizer():
+	"""
+	Splits strings into the longest keys of a table, converting each to
+	its value. Characters that aren't the start of any key are copied
+	as they are.
+	"""
+	def __init__(self, table, maxsize=100000):
+		self.trie = ara_to_lat.build_trie(table)
+		self.convert = functools.lru_cache(maxsize=maxsize)(self._convert)
+
+	def tokenize(self, text):
+		# Returns the list of (input, output) pieces text is split into
+		tokens = []
+		i = 0
+		while i < len(text):
+			node = self.trie
+			j = i
+			match = None
+			while j < len(text) and text[j] in node:
+				node = node[text[j]]
+				j += 1
+				if ara_to_lat.VALUE in node:
+					match = (j, node[ara_to_lat.VALUE])
+			if match:
+				tokens.append((text[i:match[0]], match[1]))
+				i = match[0]
+			else:
+				tokens.append((text[i], text[i]))
+				i += 1
+		return tokens
+
+	def _convert(self, text):
+		return ''.join(out for (_, out) in self.tokenize(text))
+
+	def encode(self, text, symbol_ids, unknown=-1):
+		"""
+		Converts text and returns the integer code of each output piece in
+		symbol_ids (for example MatrixAutomaton.symbol_ids), or unknown for
+		pieces that aren't in it
+		"""
+		return [symbol_ids.get(out, unknown) for (_, out) in self.tokenize(text)]
+
+ipa_to_latin = Tokenizer(IPA_TO_LATIN)
+latin_to_simple = Tokenizer(LATIN_TO_SIMPLE)
+simple_to_latin = Tokenizer({val: key for key, val in LATIN_TO_SIMPLE.items()})